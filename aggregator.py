@@ -3,8 +3,26 @@ import json
 import csv
 import os
 import re
+import sys
+from functools import lru_cache
+from operator import itemgetter
+from metrics import end_stage, start_stage
+from parse_cache import CACHE_DIR, load_partials
+from records import GradeRating, SectionProfile, intern_courses, iter_json_records
+from snapshot import snapshot_filename, write_snapshot
+
+GRADE_VALUES = {
+    "A+": 4.0, "A": 4.0, "A-": 3.67, "B+": 3.33, "B": 3.0, "B-": 2.67,
+    "C+": 2.33, "C": 2.0, "C-": 1.67, "D+": 1.33, "D": 1.00, "D-": 0.67,
+    "F": 0.0, "W": 0.67, "P": 4.0, "NP": 0.0
+}
+
+# the only section fields used for matching, everything else in the Coursebook data (textbooks, assistants, syllabus, location, ...) is skipped
+SECTION_FIELDS = ("course_prefix", "course_number", "instructors", "instructor_ids")
 
 # handles comparison between the two datasets as well as helping to normalize names within the grades dataset (i.e. both John Cole and John P Cole)
+# the same names come up over and over across sections, grade rows and matching, so each one is only normalized once per run
+@lru_cache(maxsize=None)
 def normalize_name(name):
     """Normalizes names, removes periods, handles middle names, replaces hyphens, and potential swaps."""
     name = name.strip()
@@ -22,6 +40,17 @@ def normalize_name(name):
         return name.strip().lower()
 
 
+def build_name_maps(names):
+    """Maps each original name to its normalized form and each normalized form to the original names that share it, in their original order."""
+    normalized_names = {}
+    original_names = {}
+    for name in names:
+        normalized_name = normalize_name(name)
+        normalized_names[name] = normalized_name
+        original_names.setdefault(normalized_name, []).append(name)
+    return normalized_names, original_names
+
+
 def extract_first_instructor(instructor_string, instructor_id_string):
     """Extracts the first instructor's name and ID from strings."""
     names = [normalize_name(name.strip()) for name in instructor_string.split(",")]
@@ -31,134 +60,304 @@ def extract_first_instructor(instructor_string, instructor_id_string):
     return None, None
 
 
-def process_section_data(section_data_dir="data/classes"):
-    """Processes section data to create a name-based professor mapping."""
+def iter_json_array(file, chunk_size=65536):
+    """Decodes the elements of a top-level JSON array one at a time without loading the whole file."""
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r"\s*")
+    buffer = ""
+    position = 0
+    started = False
+
+    while True:
+        position = whitespace.match(buffer, position).end()
+        if position == len(buffer): # ran out of buffered text between elements
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise json.JSONDecodeError("Unterminated array", buffer, position)
+            buffer = chunk
+            position = 0
+            continue
+
+        if not started:
+            if buffer[position] != "[":
+                raise json.JSONDecodeError("Expecting '['", buffer, position)
+            started = True
+            position += 1
+            continue
+        if buffer[position] == "]":
+            return
+        if buffer[position] == ",":
+            position += 1
+            continue
+
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            decode_error = error
+            end = None
+
+        # an element is only complete once the ',' or ']' after it is in the buffer, since a number cut off at the end of the buffer
+        # (i.e. "1." of "1.5") still decodes as a shorter value
+        if end is not None:
+            delimiter = whitespace.match(buffer, end).end()
+        if end is None or delimiter == len(buffer) or buffer[delimiter] not in ",]": # the element may be cut off, so read more and try again
+            chunk = file.read(chunk_size)
+            if chunk:
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            if end is None:
+                raise decode_error
+            if delimiter < len(buffer):
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, delimiter)
+
+        yield element
+        position = end
+
+
+def iter_sections(filepath):
+    """Streams the sections of a Coursebook JSON file, keeping only the fields used for matching."""
+    with open(filepath, "r", encoding="utf-8") as file:
+        for section in iter_json_array(file):
+            yield {field: section[field] for field in SECTION_FIELDS if field in section}
+
+
+def parse_section_file(filepath):
+    """Parses one Coursebook section file into its name -> [instructor_id, courses] profiles, in order of first appearance."""
+    section_profiles = {}
+    for section in iter_sections(filepath):
+        instructor_names = section.get("instructors", "")
+        instructor_ids = section.get("instructor_ids", "")
+        instructor_name, instructor_id = extract_first_instructor(instructor_names, instructor_ids)
+        course = f"{section['course_prefix'].upper()}{section['course_number']}"
+
+        if instructor_name:
+            profiles = section_profiles.setdefault(instructor_name, {})
+            profiles.setdefault(instructor_id, set()).add(course)
+
+    # lists rather than sets/dicts so the partial can be cached as JSON
+    return {name: [[instructor_id, sorted(courses)] for instructor_id, courses in profiles.items()] for name, profiles in section_profiles.items()}
+
+
+SECTION_TERMS = {"s": 0, "u": 1, "f": 2} # Coursebook files are named like classes_24f.json, and within a year spring comes before summer and fall
+
+
+def section_term_key(filename):
+    """Sorts a Coursebook file by the term it covers, any file not named after a term sorts before all of them by its filename."""
+    term = re.fullmatch(r"classes_(\d+)([suf])\.json", filename)
+    if term is None:
+        return (-1, -1, filename)
+    return (int(term.group(1)), SECTION_TERMS[term.group(2)], filename)
+
+
+def process_section_data(section_data_dir="data/classes", cache_dir=None, workers=1):
+    """Processes section data to create a name-based professor mapping along with an instructor_id to name index."""
+    stage_timer = start_stage("sections")
     professor_name_map = {}
-    for filename in os.listdir(section_data_dir):
-        if filename.endswith(".json"):
-            filepath = os.path.join(section_data_dir, filename)
-            with open(filepath, "r", encoding="utf-8") as file:
-                sections = json.load(file)
-                for section in sections:
-                    instructor_names = section.get("instructors", "")
-                    instructor_ids = section.get("instructor_ids", "")
-                    instructor_name, instructor_id = extract_first_instructor(instructor_names, instructor_ids)
-                    course = f"{section['course_prefix'].upper()}{section['course_number']}"
-
-                    if instructor_name:
-                        if instructor_name not in professor_name_map:
-                            professor_name_map[instructor_name] = []
-
-                        # check if the instructor_id already exists for this name
-                        found = False
-                        for prof in professor_name_map[instructor_name]:
-                            if prof["instructor_id"] == instructor_id:
-                                if "courses" not in prof:
-                                    prof["courses"] = set()
-                                prof["courses"].add(course)
-                                found = True
-                                break
-
-                        if not found:
-                            professor_name_map[instructor_name].append({
-                                "instructor_id": instructor_id,
-                                "courses": {course}
-                            })
-
-    # convert sets to lists before serialization
-    for instructor_name, profiles in professor_name_map.items():
-        for profile in profiles:
-            if "courses" in profile:
-                profile["courses"] = list(profile["courses"])
+    names_by_instructor_id = {} # instructor_id -> the first name in professor_name_map that lists it
+    name_positions = {}
+    filepaths = [os.path.join(section_data_dir, filename) for filename in sorted(os.listdir(section_data_dir), key=section_term_key, reverse=True) if filename.endswith(".json")]
 
+    # each file is parsed (or loaded from the cache) on its own and merged latest term first, so the mapping doesn't depend on the directory listing order
+    # or the number of workers, and an id listed under different spellings over the years goes by the one it's listed under most recently
+    for section_profiles in load_partials(filepaths, "sections", parse_section_file, cache_dir, workers):
+        for instructor_name, profiles in section_profiles.items():
+            if instructor_name not in professor_name_map:
+                professor_name_map[instructor_name] = []
+                name_positions[instructor_name] = len(name_positions)
+
+            for instructor_id, courses in profiles:
+                # check if the instructor_id already exists for this name
+                found = False
+                for prof in professor_name_map[instructor_name]:
+                    if prof.instructor_id == instructor_id:
+                        prof.courses.update(map(sys.intern, courses))
+                        found = True
+                        break
+
+                if not found:
+                    professor_name_map[instructor_name].append(SectionProfile(instructor_id, set(map(sys.intern, courses))))
+                    # the same id can be listed under more than one name, the one that comes first in the map wins
+                    if instructor_id not in names_by_instructor_id or name_positions[instructor_name] < name_positions[names_by_instructor_id[instructor_id]]:
+                        names_by_instructor_id[instructor_id] = instructor_name
+
+    # the course sets are kept as sets since the grade rows only check them for membership
     # with open("data/professor_name_map.json", "w", encoding="utf-8") as outfile:
     #     json.dump(professor_name_map, outfile, indent=4, ensure_ascii=False)
-    return professor_name_map
+    end_stage(stage_timer, items=len(professor_name_map))
+    return professor_name_map, names_by_instructor_id
+
+
+def grade_columns(header):
+    """Resolves the instructor, subject, catalog number and grade column positions from a grade CSV header."""
+    positions = {name: i for i, name in enumerate(header)} # a repeated column name uses its last position, same as csv.DictReader
+    missing = len(header) # columns the file doesn't have point one past the end of the row, where every row gets an empty cell
+    catalog_nbr = positions.get('"Catalog Nbr"', positions.get("Catalog Nbr", missing))
+    return (
+        positions.get("Instructor 1", missing),
+        positions.get("Subject", missing),
+        catalog_nbr,
+        [positions.get(grade, missing) for grade in GRADE_VALUES],
+    )
+
+
+def iter_grade_rows(filepath):
+    """Reads the instructor, course and grade counts of each row of a grade CSV, skipping the rows that have no grades or are missing a field."""
+    with open(filepath, "r", encoding="utf-8-sig") as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        instructor_column, subject_column, catalog_column, grade_positions = grade_columns(header)
+        width = len(header) + 1
+        grade_cells = itemgetter(*grade_positions)
+
+        for row in reader:
+            if len(row) < width:
+                row.extend([""] * (width - len(row)))
+            cells = grade_cells(row)
+            if not any(cells): # nothing but empty cells, i.e. the rows that only have CR/I/NC grades
+                continue
+            subject = row[subject_column].strip()
+            catalog_nbr = row[catalog_column].strip()
+            if not subject or not catalog_nbr:
+                continue
+            try:
+                row_grades = [int(cell or 0) for cell in cells]
+            except ValueError: # counts written out as floats, i.e. 3.0
+                row_grades = [int(float(cell or 0)) for cell in cells]
+            if sum(row_grades) == 0:
+                continue
+            instructor = normalize_name(row[instructor_column])
+            if instructor:
+                yield instructor, f"{subject}{catalog_nbr}", row_grades
+
+
+def parse_grade_file(filepath):
+    """Parses one grade CSV into its [instructor, course] groups and a matching grade count matrix, in order of first appearance."""
+    import numpy as np # only the grade functions need numpy, so reload mode can use the name helpers here without importing it
+    group_ids = {}
+    row_groups = []
+    row_counts = []
+    for instructor, course, row_grades in iter_grade_rows(filepath):
+        row_groups.append(group_ids.setdefault((instructor, course), len(group_ids)))
+        row_counts.append(row_grades)
+
+    # one column per grade, the rows of each (instructor, course) group are summed into a single row
+    counts = np.zeros((len(group_ids), len(GRADE_VALUES)), dtype=np.int64)
+    if row_counts:
+        np.add.at(counts, np.array(row_groups), np.array(row_counts, dtype=np.int64))
 
+    # lists rather than arrays so the partial can be cached as JSON
+    return {"groups": [[instructor, course] for instructor, course in group_ids], "counts": counts.tolist()}
 
-def calculate_professor_ratings(grades_data_dir="data/grades", section_data_dir="data/classes", output_filename="ratings/grade_ratings.json"):
+
+def weighted_sums(counts, weights):
+    """Multiplies a grade count matrix by the grade weights, one column at a time."""
+    import numpy as np
+    # the columns are accumulated in grade order rather than with a BLAS product so every float is added in the same order
+    # as summing the grades one by one, which keeps the rounded ratings identical
+    sums = np.zeros(len(counts))
+    for column, weight in enumerate(weights):
+        sums = sums + weight * counts[:, column]
+    return sums
+
+
+def grade_ratings(counts, weights):
+    """Rates each row of a grade count matrix on a five point scale, returning the ratings and the row totals."""
+    import numpy as np
+    totals = counts.sum(axis=1)
+    points = weighted_sums(counts, weights)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratings = (points / totals) / 4.0 * 5
+    # rounded as python floats since numpy rounds halves differently than round()
+    return [round(float(rating), 2) if total > 0 else "N/A" for rating, total in zip(ratings, totals)], [int(total) for total in totals]
+
+
+def calculate_professor_ratings(grades_data_dir="data/grades", section_data_dir="data/classes", output_filename="ratings/grade_ratings.json", cache_dir=CACHE_DIR, workers=1, snapshot_format="json"):
     """Calculates professor ratings based on grade distributions from CSV files."""
-    professor_data = {}
-    professor_name_map = process_section_data(section_data_dir)
+    import numpy as np
+    professor_name_map, names_by_instructor_id = process_section_data(section_data_dir, cache_dir, workers)
     print("Professor data retrieved from coursebook sections, processing grade data...")
-    grade_values = {
-        "A+": 4.0, "A": 4.0, "A-": 3.67, "B+": 3.33, "B": 3.0, "B-": 2.67,
-        "C+": 2.33, "C": 2.0, "C-": 1.67, "D+": 1.33, "D": 1.00, "D-": 0.67,
-        "F": 0.0, "W": 0.67, "P": 4.0, "NP": 0.0
-    }
+    grade_values = GRADE_VALUES
+    stage_timer = start_stage("grade_aggregation")
 
     try:
-        for filename in os.listdir(grades_data_dir):
-            if filename.endswith(".csv"):
-                filepath = os.path.join(grades_data_dir, filename)
-                with open(filepath, "r", encoding="utf-8-sig") as csvfile:
-                    # print(f"Processing {filename}...")
-                    reader = csv.DictReader(csvfile)
-                    for row in reader:
-                        instructor = normalize_name(row.get("Instructor 1", ""))
-                        subject = row.get("Subject", "").strip()
-                        catalog_nbr = row.get('"Catalog Nbr"') or row.get("Catalog Nbr", "")
-                        catalog_nbr = catalog_nbr.strip()
-                        course = f"{subject}{catalog_nbr}"
-                        row_grades = {grade: int(float(row.get(grade, 0) or 0)) for grade in grade_values}
-                        if not instructor or not subject or not catalog_nbr or sum(row_grades.values()) == 0:
-                            continue
-
-                        if instructor in professor_name_map:
-                            profiles = professor_name_map[instructor]
-                            for profile in profiles:
-                                if course in profile["courses"]:
-                                    instructor_id = profile["instructor_id"]
-                                    if instructor_id not in professor_data:
-                                        professor_data[instructor_id] = {"course_grades": {}}
-                                    if course not in professor_data[instructor_id]["course_grades"]:
-                                        professor_data[instructor_id]["course_grades"][course] = {g: 0 for g in grade_values}
-                                    for grade, count in row_grades.items():
-                                        professor_data[instructor_id]["course_grades"][course][grade] += count
+        filepaths = [os.path.join(grades_data_dir, filename) for filename in sorted(os.listdir(grades_data_dir)) if filename.endswith(".csv")]
+
+        # every file's groups are handed out to the matching profiles as (instructor_id, course) group ids, assigned in the order
+        # they first appear so the instructors and courses come out in the same order as going through the rows one at a time
+        group_ids = {}
+        professor_groups = {} # instructor_id -> its group ids, in course order
+        partial_counts = []
+        partial_rows = []
+        partial_groups = []
+        for grade_partial in load_partials(filepaths, "grades", parse_grade_file, cache_dir, workers):
+            rows = []
+            groups = []
+            for row, (instructor, course) in enumerate(grade_partial["groups"]):
+                if instructor in professor_name_map:
+                    for profile in professor_name_map[instructor]:
+                        if course in profile.courses:
+                            instructor_id = profile.instructor_id
+                            key = (instructor_id, course)
+                            if key not in group_ids:
+                                group_ids[key] = len(group_ids)
+                                professor_groups.setdefault(instructor_id, []).append(group_ids[key])
+                            rows.append(row)
+                            groups.append(group_ids[key])
+            partial_counts.append(np.array(grade_partial["counts"], dtype=np.int64).reshape(-1, len(grade_values)))
+            partial_rows.append(rows)
+            partial_groups.append(groups)
+
+        # grouped sums of every file's rows into one count matrix per course, then per instructor
+        course_counts = np.zeros((len(group_ids), len(grade_values)), dtype=np.int64)
+        for counts, rows, groups in zip(partial_counts, partial_rows, partial_groups):
+            if rows:
+                np.add.at(course_counts, np.array(groups), counts[np.array(rows)])
+
+        courses = intern_courses(course for _, course in group_ids)
+        instructor_ids = list(professor_groups)
+        group_instructors = np.zeros(len(group_ids), dtype=np.int64)
+        for position, instructor_id in enumerate(instructor_ids):
+            group_instructors[professor_groups[instructor_id]] = position
+        instructor_counts = np.zeros((len(instructor_ids), len(grade_values)), dtype=np.int64)
+        np.add.at(instructor_counts, group_instructors, course_counts)
 
     except Exception as e:
         print("Error processing grade data:", e)
+        end_stage(stage_timer)
         return None
 
+    weights = list(grade_values.values())
+    course_rating_values, _ = grade_ratings(course_counts, weights)
+    overall_ratings, total_counts = grade_ratings(instructor_counts, weights)
+
     filtered_data = {}
-    for instructor_id, data in professor_data.items():
-        all_grades = {}
-        for course, grades in data["course_grades"].items():
-            for grade, count in grades.items():
-                all_grades[grade] = all_grades.get(grade, 0) + count
-        total_points = sum(grade_values[grade] * count for grade, count in all_grades.items())
-        total_count = sum(all_grades.values())
-        overall_rating = round((total_points / total_count) / 4.0 * 5, 2) if total_count > 0 else "N/A"
-        course_ratings = {}
-        for course, grades in data["course_grades"].items():
-            course_points = sum(grade_values[grade] * count for grade, count in grades.items())
-            course_count = sum(grades.values())
-            course_ratings[course] = round((course_points / course_count) / 4.0 * 5, 2) if course_count > 0 else "N/A"
-
-        instructor_name = next((name for name, profs in professor_name_map.items() if any(prof['instructor_id'] == instructor_id for prof in profs)), None)
+    for position, instructor_id in enumerate(instructor_ids):
+        overall_rating = overall_ratings[position]
+        total_count = total_counts[position]
+        course_ratings = {courses[group]: course_rating_values[group] for group in professor_groups[instructor_id]}
+
+        instructor_name = names_by_instructor_id.get(instructor_id)
 
         # it would be nice to have the original instructor name attached as a property, but we have to normalize it because the grades data is aggregated across
         # multiple sections and the names are not always consistent (i.e. John Cole vs John P Cole)
         if instructor_name:
             if instructor_name not in filtered_data:
                 filtered_data[instructor_name] = []
-            filtered_data[instructor_name].append({
-                "instructor_id": instructor_id,
-                "overall_grade_rating": overall_rating,
-                "total_grade_count": total_count,
-                "course_ratings": course_ratings,
-            })
+            filtered_data[instructor_name].append(GradeRating(instructor_id, overall_rating, total_count, course_ratings))
+    end_stage(stage_timer, items=len(group_ids))
 
-    with open(output_filename, "w", encoding="utf-8") as outfile:
-        json.dump(filtered_data, outfile, indent=4, ensure_ascii=False)
+    stage_timer = start_stage("ratings_output")
+    write_snapshot(iter_json_records(filtered_data), output_filename, snapshot_format)
+    end_stage(stage_timer, items=len(filtered_data))
 
-    print(f"Professor ratings (without grades) saved to {output_filename}")
+    print(f"Professor ratings (without grades) saved to {snapshot_filename(output_filename, snapshot_format)}")
 
     # test print to identify names with multiple IDs
     for name, profiles in filtered_data.items():
         if len(profiles) > 1:
             print(f"Instructor name '{name}' has multiple associated IDs:")
             for profile in profiles:
-                print(f"  - ID: {profile['instructor_id']}")
+                print(f"  - ID: {profile.instructor_id}")
 
     return filtered_data
\ No newline at end of file
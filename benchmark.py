@@ -0,0 +1,1044 @@
+import json
+import argparse
+import base64
+import contextlib
+import csv
+import importlib.util
+import io
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import scraper
+from snapshot import SNAPSHOT_FORMATS, load_snapshot, snapshot_filename, write_snapshot
+from store import connect_store, export_store, find_course_professors, find_professor
+from aggregator import GRADE_VALUES, calculate_professor_ratings, iter_grade_rows, normalize_name, parse_section_file, process_section_data, section_term_key
+from metrics import end_stage, reset_metrics, stage_seconds, start_stage
+from records import iter_json_records, ratings_from_json, rmp_from_json
+from main import FUZZY_SCORERS, best_owner_match, build_candidate_index, find_best_fuzzy_match, find_fuzzy_candidates, fuzzy_ratio, generate_name_variations, iter_matched_records, match_professor_names, resolve_scorer, score_fuzzy_candidates, variation_owners
+
+
+def load_benchmark_data(ratings_filename="ratings/grade_ratings.json", rmp_filename="ratings/rmp_ratings.json"):
+    """Loads the grade ratings and RMP data used as benchmark inputs."""
+    with open(ratings_filename, "r", encoding="utf-8") as file:
+        ratings = json.load(file)
+    with open(rmp_filename, "r", encoding="utf-8") as file:
+        rmp_data = json.load(file)
+    return ratings, rmp_data
+
+
+def scale_names(names, factor, seed=0):
+    """Scales a list of names by recombining the first and last names already in it."""
+    rng = random.Random(seed)
+    first_names = [name.split()[0] for name in names if len(name.split()) > 1]
+    last_names = [name.split()[-1] for name in names if len(name.split()) > 1]
+    scaled = list(names)
+    seen = set(scaled)
+    while len(scaled) < len(names) * factor:
+        name = f"{rng.choice(first_names)} {rng.choice(last_names)}"
+        if name not in seen:
+            seen.add(name)
+            scaled.append(name)
+    return scaled
+
+
+def scale_dataset(ratings, rmp_data, factor, seed=0):
+    """Scales the ratings and RMP datasets together, copying entries under new names and ids so the copies match each other like the originals."""
+    rng = random.Random(seed)
+    names = list(ratings.keys())
+    new_names = scale_names(names, factor, seed)[len(names):]
+    scaled_ratings = dict(ratings)
+    scaled_rmp_data = dict(rmp_data)
+    for copy_number, new_name in enumerate(new_names):
+        name = rng.choice(names)
+        scaled_ratings[new_name] = [{**entry, "instructor_id": f"{entry['instructor_id']}-{copy_number}"} for entry in ratings[name]]
+        if name in rmp_data:
+            scaled_rmp_data[new_name] = [{**entry, "rmp_id": f"{entry['rmp_id']}-{copy_number}"} for entry in rmp_data[name]]
+    return scaled_ratings, scaled_rmp_data
+
+
+def benchmark_matching(ratings, rmp_data, workers=1):
+    """Times a full matching pass, writing the unmatched files to a temporary directory."""
+    results = {
+        "ratings_entries": sum(len(entries) for entries in ratings.values()),
+        "rmp_entries": sum(len(entries) for entries in rmp_data.values()),
+    }
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.makedirs(os.path.join(temp_dir, "unmatched"))
+        os.chdir(temp_dir)
+        try:
+            start_time = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                match_professor_names(ratings, rmp_data, workers=workers)
+            results["matching_seconds"] = round(time.time() - start_time, 3)
+        finally:
+            os.chdir(working_dir)
+    return results
+
+
+def benchmark_section_parsing(section_data_dir="data/classes"):
+    """Times the Coursebook section parsing, checks every instructor ID goes by a name from its latest term and measures the peak traced memory in a second pass."""
+    results = {}
+    start_time = time.time()
+    professor_name_map, names_by_instructor_id = process_section_data(section_data_dir)
+    results["section_seconds"] = round(time.time() - start_time, 3)
+    results["instructor_names"] = len(professor_name_map)
+
+    # the names each ID is listed under in the latest term that lists it, the grade ratings are stored under one of them
+    latest_names = {}
+    for filename in sorted((filename for filename in os.listdir(section_data_dir) if filename.endswith(".json")), key=section_term_key):
+        term_names = {}
+        for instructor_name, profiles in parse_section_file(os.path.join(section_data_dir, filename)).items():
+            for instructor_id, _ in profiles:
+                term_names.setdefault(instructor_id, set()).add(instructor_name)
+        latest_names.update(term_names)
+    results["latest_term_names"] = all(names_by_instructor_id[instructor_id] in names for instructor_id, names in latest_names.items())
+
+    tracemalloc.start()
+    try:
+        process_section_data(section_data_dir)
+        results["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def benchmark_parsing(workers, grades_data_dir="data/grades", section_data_dir="data/classes"):
+    """Times parsing every section and grade file without the cache using the given number of worker processes."""
+    results = {"workers": workers}
+    start_time = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_section_data(section_data_dir, cache_dir=None, workers=workers)
+    results["section_seconds"] = round(time.time() - start_time, 3)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start_time = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            calculate_professor_ratings(grades_data_dir, section_data_dir, os.path.join(temp_dir, "grade_ratings.json"), cache_dir=None, workers=workers)
+        results["ratings_seconds"] = round(time.time() - start_time, 3)
+    return results
+
+
+def iter_dictreader_grade_rows(filepath):
+    """Reads a grade CSV the way the grade loop used to, with a csv.DictReader lookup for every field."""
+    with open(filepath, "r", encoding="utf-8-sig") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            instructor = normalize_name(row.get("Instructor 1", ""))
+            subject = row.get("Subject", "").strip()
+            catalog_nbr = row.get('"Catalog Nbr"') or row.get("Catalog Nbr", "")
+            catalog_nbr = catalog_nbr.strip()
+            course = f"{subject}{catalog_nbr}"
+            row_grades = [int(float(row.get(grade, 0) or 0)) for grade in GRADE_VALUES]
+            if not instructor or not subject or not catalog_nbr or sum(row_grades) == 0:
+                continue
+            yield instructor, course, row_grades
+
+
+def benchmark_grade_rows(grades_data_dir="data/grades", repeat=3):
+    """Times reading every grade CSV with the csv.DictReader loop and with the positional reader, in rows per second."""
+    filepaths = [os.path.join(grades_data_dir, filename) for filename in sorted(os.listdir(grades_data_dir)) if filename.endswith(".csv")]
+    total_rows = 0
+    for filepath in filepaths:
+        with open(filepath, "r", encoding="utf-8-sig") as csvfile:
+            total_rows += sum(1 for _ in csv.DictReader(csvfile))
+
+    results = {"files": len(filepaths), "rows": total_rows}
+    rows = {}
+    for label, read_rows in (("dictreader", iter_dictreader_grade_rows), ("positional", iter_grade_rows)):
+        best_seconds = None
+        for _ in range(repeat):
+            normalize_name.cache_clear() # both readers start from an empty name cache
+            start_time = time.time()
+            rows[label] = [row for filepath in filepaths for row in read_rows(filepath)]
+            seconds = time.time() - start_time
+            best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+        results[f"{label}_seconds"] = round(best_seconds, 3)
+        results[f"{label}_rows_per_second"] = round(total_rows / best_seconds)
+
+    results["kept_rows"] = len(rows["positional"])
+    results["identical_rows"] = rows["dictreader"] == rows["positional"]
+    return results
+
+
+def build_stub_teachers(rmp_data):
+    """Converts stored RMP data back into the teacher nodes the GraphQL API returns."""
+    teachers = []
+    for entries in rmp_data.values():
+        for entry in entries:
+            first_name, _, last_name = entry["original_rmp_format"].partition(" ")
+            teachers.append({
+                "id": f"stub-{entry['rmp_id']}",
+                "legacyId": entry["rmp_id"],
+                "avgRating": entry["quality_rating"],
+                "avgDifficulty": entry["difficulty_rating"],
+                "wouldTakeAgainPercent": entry["would_take_again"],
+                "numRatings": entry["ratings_count"],
+                "courseCodes": [{"courseName": course, "courseCount": 1} for course in entry["courses"]],
+                "department": entry["department"],
+                "school": {"name": "Stub University", "id": "stub"},
+                "firstName": first_name,
+                "lastName": last_name,
+                "isSaved": False,
+                "teacherRatingTags": [{"legacyId": i, "tagCount": len(entry["tags"]) - i, "tagName": tag, "id": f"tag-{i}"} for i, tag in enumerate(entry["tags"])],
+                "__typename": "Teacher",
+            })
+    return teachers
+
+
+class StubGraphQLHandler(BaseHTTPRequestHandler):
+    """Serves teacher search pages like the RMP GraphQL API, with optional latency and failures."""
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        variables = request["variables"]
+        cursor = variables["cursor"]
+        offset = int(base64.b64decode(cursor).decode().split(":")[1]) + 1 if cursor else 0
+        with server.lock:
+            server.requests_served += 1
+            failed = offset in server.fail_offsets or server.rng.random() < server.failure_rate
+
+        time.sleep(server.latency)
+        if failed:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        edges = [{"cursor": scraper.page_cursor(offset + i), "node": node} for i, node in enumerate(server.teachers[offset:offset + variables["count"]])]
+        body = json.dumps({"data": {"search": {"teachers": {
+            "didFallback": False,
+            "edges": edges,
+            "pageInfo": {"hasNextPage": offset + len(edges) < len(server.teachers), "endCursor": edges[-1]["cursor"] if edges else None},
+            "resultCount": len(server.teachers),
+            "filters": [],
+        }}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(teachers, latency=0.0, failure_rate=0.0, seed=0):
+    """Starts a local GraphQL stub server in a background thread, returning the server and its URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGraphQLHandler)
+    server.daemon_threads = True
+    server.teachers = teachers
+    server.latency = latency
+    server.failure_rate = failure_rate
+    server.fail_offsets = set()
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.requests_served = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/graphql"
+
+
+def comparable_professors(professors):
+    """Drops the fetch timestamps and sorts the course lists so two scrapes of the same data compare equal."""
+    return {name: [{**entry, "last_updated": None, "courses": sorted(entry["courses"])} for entry in entries] for name, entries in professors.items()}
+
+
+def expected_professors(teachers):
+    """Builds the professor data a complete scrape of the teachers should return, in the order the API lists them."""
+    professors = {}
+    for node in teachers:
+        key = scraper.normalize_professor_name(f"{node['firstName']} {node['lastName']}")
+        professors.setdefault(key, []).append(scraper.build_professor_data(node))
+    return comparable_professors(professors)
+
+
+def check_interrupted_refresh(rmp_data, graphql_url):
+    """Runs an incremental scrape that gets interrupted and checks it left the stored RMP data alone and logged no changes."""
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir) # the page checkpoints go in cache/ under the working directory
+        try:
+            with open("headers.json", "w", encoding="utf-8") as f:
+                json.dump({"university_id": "stub", "school_id": "stub", "headers": {"Content-Type": "application/json"}}, f)
+            write_snapshot(rmp_data, "rmp_ratings.json")
+            with open("rmp_ratings.json", "rb") as f:
+                stored = f.read()
+            with contextlib.redirect_stdout(io.StringIO()):
+                professors = scraper.scrape_rmp_data("stub", graphql_url, "headers.json", incremental=True, output_filename="rmp_ratings.json", change_log_file="rmp_changes.jsonl")
+            with open("rmp_ratings.json", "rb") as f:
+                untouched = f.read() == stored
+            return professors is None and untouched and not os.path.exists("rmp_changes.jsonl")
+        finally:
+            os.chdir(working_dir)
+
+
+def benchmark_scrape(rmp_data, workers, latency=0.2, failure_rate=0.0):
+    """Times scraping a local stub of the GraphQL API with the given number of workers, then checks an interrupted scrape resumes from its checkpoints."""
+    teachers = build_stub_teachers(rmp_data)
+    server, graphql_url = start_stub_server(teachers, latency, failure_rate)
+    scraper.RETRY_BACKOFF = 0.01 # the stub's failures are instant, so there's no need to wait on them like the real API
+    expected = expected_professors(teachers)
+    results = {"teachers": len(teachers), "pages": -(-len(teachers) // scraper.PAGE_SIZE), "workers": workers}
+    try:
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            start_time = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                professors = scraper.query_rmp({}, "stub", graphql_url, workers, checkpoint_dir)
+            results["scrape_seconds"] = round(time.time() - start_time, 3)
+            results["requests"] = server.requests_served
+            results["identical_to_expected"] = comparable_professors(professors) == expected
+
+            # fail every request for the second page so the first run gives up on it, then let the rerun resume
+            server.failure_rate = 0.0
+            server.fail_offsets = {scraper.PAGE_SIZE}
+            server.requests_served = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                interrupted = scraper.query_rmp({}, "stub", graphql_url, workers, checkpoint_dir)
+            server.fail_offsets = set()
+            interrupted_requests = server.requests_served
+            results["interrupted_result_withheld"] = interrupted is None
+            results["stale_checkpoint_ignored"] = scraper.load_checkpoint("stub", "", checkpoint_dir) is not None and scraper.load_checkpoint("stub", "", checkpoint_dir, max_age=-1) is None
+            server.requests_served = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                resumed = scraper.query_rmp({}, "stub", graphql_url, workers, checkpoint_dir)
+            results["interrupted_requests"] = interrupted_requests
+            results["resumed_requests"] = server.requests_served
+            results["resumed_identical"] = comparable_professors(resumed) == expected
+            results["checkpoints_left"] = len(os.listdir(checkpoint_dir))
+            results["checkpoints_removed"] = results["checkpoints_left"] == 0
+
+            # a stopped scrape gives up before requesting anything, the way it does when the pipeline fails while it runs
+            server.requests_served = 0
+            scraper.scrape_stop.set()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stopped = scraper.query_rmp({}, "stub", graphql_url, workers, checkpoint_dir)
+            finally:
+                scraper.scrape_stop.clear()
+            results["stopped_result_withheld"] = stopped is None and server.requests_served == 0
+
+        # an incremental refresh of an interrupted scrape must not count the professors on the missing pages as removed
+        server.fail_offsets = {scraper.PAGE_SIZE}
+        results["interrupted_refresh_untouched"] = check_interrupted_refresh(rmp_data, graphql_url)
+        server.fail_offsets = set()
+    finally:
+        server.shutdown()
+    return results
+
+
+def benchmark_snapshot(filename, repeat=3):
+    """Times writing and loading one artifact in every snapshot format and compares the file sizes."""
+    data = load_snapshot(filename)
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, os.path.basename(filename))
+        for snapshot_format in SNAPSHOT_FORMATS:
+            write_seconds = []
+            load_seconds = []
+            for _ in range(repeat):
+                start_time = time.time()
+                write_snapshot(data, path, snapshot_format)
+                write_seconds.append(time.time() - start_time)
+
+                start_time = time.time()
+                loaded = load_snapshot(path, snapshot_format)
+                load_seconds.append(time.time() - start_time)
+
+            results[snapshot_format] = {
+                "write_seconds": round(min(write_seconds), 4),
+                "load_seconds": round(min(load_seconds), 4),
+                "size_kb": round(os.path.getsize(snapshot_filename(path, snapshot_format)) / 1024, 1),
+                "identical": loaded == data,
+            }
+    return results
+
+
+def benchmark_records(ratings_filename="ratings/grade_ratings.json", rmp_filename="ratings/rmp_ratings.json"):
+    """Compares the traced memory of the grade ratings and RMP datasets as loaded JSON dicts and as the records the matcher uses."""
+    results = {}
+    for label, filename, from_json in (("ratings", ratings_filename, ratings_from_json), ("rmp", rmp_filename, rmp_from_json)):
+        tracemalloc.start()
+        try:
+            data = load_snapshot(filename)
+            dict_bytes = tracemalloc.get_traced_memory()[0]
+            start_time = time.time()
+            records = from_json(data)
+            convert_seconds = time.time() - start_time
+            identical = dict(iter_json_records(records)) == data
+            del data # the interned strings the records share stay traced, so this counts everything the records still point at
+            record_bytes = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        results[label] = {
+            "entries": sum(len(entries) for entries in records.values()),
+            "dict_mb": round(dict_bytes / 1e6, 2),
+            "record_mb": round(record_bytes / 1e6, 2),
+            "saved": f"{1 - record_bytes / dict_bytes:.0%}",
+            "convert_seconds": round(convert_seconds, 4),
+            "identical": identical,
+        }
+        del records
+    return results
+
+
+def scan_professor(matched_data, name):
+    """Finds a professor's entries by scanning the whole matched data, the way the site had to before the store."""
+    normalized_name = normalize_name(name)
+    return [entry for matched_name, entries in matched_data.items() if normalize_name(matched_name) == normalized_name for entry in entries]
+
+
+def scan_course_professors(matched_data, course_code):
+    """Finds every professor that has taught a course by scanning the whole matched data."""
+    return [
+        {"name": name, "course_rating": entry["course_ratings"][course_code], "quality_rating": entry.get("quality_rating")}
+        for name, entries in matched_data.items() for entry in entries if course_code in entry.get("course_ratings", {})
+    ]
+
+
+def benchmark_store(matched_filename="matched/matched_professor_data.json", queries=200, seed=0):
+    """Times exporting the matched data to the SQLite store and compares its lookups with scanning the JSON file."""
+    rng = random.Random(seed)
+    start_time = time.time()
+    matched_data = load_snapshot(matched_filename)
+    results = {"json_load_seconds": round(time.time() - start_time, 4)}
+    names = rng.sample(list(matched_data), min(queries, len(matched_data)))
+    courses = rng.sample(sorted({course for entries in matched_data.values() for entry in entries for course in entry.get("course_ratings", {})}), queries)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "professors.db")
+        start_time = time.time()
+        results.update(export_store(matched_data.items(), db_path))
+        results["export_seconds"] = round(time.time() - start_time, 4)
+        results["store_size_kb"] = round(os.path.getsize(db_path) / 1024, 1)
+
+        conn = connect_store(db_path)
+        try:
+            for label, scan, query, keys in (("name", scan_professor, find_professor, names), ("course", scan_course_professors, find_course_professors, courses)):
+                start_time = time.time()
+                scanned = [scan(matched_data, key) for key in keys]
+                results[f"json_scan_{label}_query_ms"] = round((time.time() - start_time) / len(keys) * 1000, 3)
+
+                start_time = time.time()
+                queried = [query(conn, key) for key in keys]
+                results[f"sqlite_{label}_query_ms"] = round((time.time() - start_time) / len(keys) * 1000, 3)
+                results[f"identical_{label}_results"] = scanned == queried
+        finally:
+            conn.close()
+    return results
+
+
+def benchmark_fuzzy_phase(ratings_names, rmp_names, fuzzy_threshold=80, exhaustive=False):
+    """Times the fuzzy phase with the candidate index and optionally against the full scan."""
+    normalized_rmp_data = {normalize_name(name): [] for name in rmp_names}
+    fuzzy_names = [normalize_name(name) for name in ratings_names]
+    fuzzy_names = [name for name in fuzzy_names if name not in normalized_rmp_data] # direct matches never reach the fuzzy phase
+
+    results = {"ratings_names": len(fuzzy_names), "rmp_names": len(normalized_rmp_data)}
+
+    start_time = time.time()
+    candidate_index = build_candidate_index(normalized_rmp_data)
+    results["index_seconds"] = round(time.time() - start_time, 3)
+
+    candidate_names = 0
+    counters = {"ratio_calls": 0, "ratio_calls_saved": 0}
+    candidate_seconds = 0
+    scoring_seconds = 0
+    indexed_matches = []
+    for ratings_norm in fuzzy_names:
+        start_time = time.time()
+        candidates = find_fuzzy_candidates(candidate_index, generate_name_variations(ratings_norm), fuzzy_threshold)
+        candidate_seconds += time.time() - start_time
+
+        start_time = time.time()
+        indexed_matches.append(score_fuzzy_candidates(candidate_index, candidates, fuzzy_threshold, counters=counters))
+        scoring_seconds += time.time() - start_time
+
+        candidate_names += len({position for _, variation_id in candidates for position in variation_owners(candidate_index, variation_id)})
+
+    results["candidate_seconds"] = round(candidate_seconds, 3)
+    results["scoring_seconds"] = round(scoring_seconds, 3)
+    results["fuzzy_phase_seconds"] = round(results["index_seconds"] + candidate_seconds + scoring_seconds, 3)
+    results["candidate_name_pairs"] = candidate_names
+    results["candidate_variation_pairs"] = counters["ratio_calls"]
+    results["ratio_calls_saved"] = counters["ratio_calls_saved"]
+    results["exhaustive_name_pairs"] = len(fuzzy_names) * len(normalized_rmp_data)
+    results["exhaustive_variation_pairs"] = sum(len(generate_name_variations(name)) for name in fuzzy_names) * len(candidate_index["owner_positions"])
+
+    if exhaustive:
+        start_time = time.time()
+        exhaustive_matches = [find_best_fuzzy_match(name, normalized_rmp_data, fuzzy_threshold) for name in fuzzy_names]
+        results["exhaustive_seconds"] = round(time.time() - start_time, 3)
+        results["identical_matches"] = indexed_matches == exhaustive_matches
+
+    return results
+
+
+def benchmark_scorers(ratings_names, rmp_names, fuzzy_threshold=80):
+    """Times each installed name scorer on the same fuzzy candidates and compares the best matches they pick."""
+    normalized_rmp_data = {normalize_name(name): [] for name in rmp_names}
+    fuzzy_names = [normalize_name(name) for name in ratings_names]
+    fuzzy_names = [name for name in dict.fromkeys(fuzzy_names) if name not in normalized_rmp_data]
+    candidate_index = build_candidate_index(normalized_rmp_data)
+    candidates = [find_fuzzy_candidates(candidate_index, generate_name_variations(name), fuzzy_threshold) for name in fuzzy_names]
+    candidate_pairs = sum(len(name_candidates) for name_candidates in candidates)
+
+    scorers = ["fuzzywuzzy"]
+    if importlib.util.find_spec("rapidfuzz"):
+        scorers.append("rapidfuzz")
+    results = {"ratings_names": len(fuzzy_names), "rmp_names": len(normalized_rmp_data), "candidate_variation_pairs": candidate_pairs}
+    matches = {}
+    for scorer in scorers:
+        start_time = time.time()
+        matches[scorer] = [score_fuzzy_candidates(candidate_index, name_candidates, fuzzy_threshold, scorer) for name_candidates in candidates]
+        seconds = time.time() - start_time
+        results[scorer] = {"seconds": round(seconds, 3), "pairs_per_second": round(candidate_pairs / seconds)}
+
+    if "rapidfuzz" in matches:
+        # the batch scores have to agree with scoring every pair on its own
+        pairwise_matches = []
+        for name_candidates in candidates:
+            scores = [fuzzy_ratio(ratings_variation, candidate_index["variations"][variation_id], "rapidfuzz", fuzzy_threshold) for ratings_variation, variation_id in name_candidates]
+            pairwise_matches.append(best_owner_match(candidate_index, name_candidates, scores, fuzzy_threshold))
+        results["rapidfuzz"]["identical_to_pairwise"] = matches["rapidfuzz"] == pairwise_matches
+
+        # rapidfuzz only decides which pairs get scored, so every name has to end up with the same best match and score as with fuzzywuzzy
+        differences = []
+        for name, fuzzywuzzy_match, rapidfuzz_match in zip(fuzzy_names, matches["fuzzywuzzy"], matches["rapidfuzz"]):
+            if fuzzywuzzy_match != rapidfuzz_match:
+                differences.append({"name": name, "fuzzywuzzy": list(fuzzywuzzy_match), "rapidfuzz": list(rapidfuzz_match)})
+        results["identical_best_matches"] = not differences
+        results["different_best_matches"] = differences
+
+    return results
+
+
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth", "William", "Barbara", "Richard", "Susan",
+    "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen", "Wei", "Yan", "Jing", "Li", "Ravi", "Priya", "Anil", "Sunita", "Mohammed",
+    "Fatima", "Ahmed", "Aisha", "Carlos", "Maria", "Jose", "Ana", "Luis", "Sofia", "Hyun", "Min", "Ji", "Seo", "Olga", "Ivan", "Dmitri",
+    "Elena", "Kwame", "Amara", "Chinedu", "Ngozi", "Andres", "Bhadrachalam", "Yu Chung", "Mei Ling", "Jean Pierre", "Anna Maria",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez",
+    "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Wang", "Zhang", "Chen", "Liu", "Yang", "Huang", "Kumar",
+    "Patel", "Sharma", "Singh", "Gupta", "Khan", "Ali", "Hassan", "Kim", "Park", "Choi", "Nguyen", "Tran", "Ivanov", "Petrov", "Okafor",
+    "Mensah", "Sanchez De La Rosa", "Busso Recabarren", "O'Brien", "McDonald", "Van Der Berg", "De Souza", "Chitturi", "Nedbal",
+]
+SURNAME_SYLLABLES = ["ka", "ro", "mi", "den", "shaw", "li", "ton", "ber", "ga", "vin", "mor", "ez", "ha", "ru", "sel", "ko", "wa", "nak", "ov", "ski", "ma", "tel", "ay", "dor"]
+NICKNAMES = {"Robert": "Bob", "William": "Bill", "Richard": "Rick", "Joseph": "Joe", "Thomas": "Tom", "Michael": "Mike", "Elizabeth": "Liz", "Jennifer": "Jen", "Patricia": "Pat", "Charles": "Chuck"}
+DEPARTMENTS = ["ACCT", "BIOL", "CHEM", "CS", "ECON", "GOVT", "HIST", "MATH", "MECH", "PHYS", "PSY", "SE"]
+RMP_TAGS = ["Tough grader", "Caring", "Lecture heavy", "Clear grading criteria", "Amazing lectures", "Get ready to read", "Respected", "Gives good feedback", "Test heavy", "Participation matters"]
+GRADE_FILE_COLUMNS = ["Subject", "Catalog Nbr", "Section", "A+", "A", "A-", "B+", "B", "B-", "C+", "C", "C-", "D+", "D", "D-", "F", "CR", "I", "NC", "W", "P",
+                      "Instructor 1", "Instructor 2", "Instructor 3", "Instructor 4", "Instructor 5", "Instructor 6"]
+SYNTHETIC_TERMS = [("17f", "Fall 2017"), ("18s", "Spring 2018"), ("18f", "Fall 2018"), ("19s", "Spring 2019"), ("19f", "Fall 2019"), ("20s", "Spring 2020")]
+
+# modules reload mode must never import, and the heavier optional ones whose import is reported
+RELOAD_FORBIDDEN_IMPORTS = ["selenium", "seleniumwire"]
+REPORTED_IMPORTS = ["selenium", "seleniumwire", "requests", "numpy", "fuzzywuzzy", "rapidfuzz", "msgpack", "multiprocessing"]
+
+# the stages of a full run, as recorded by the pipeline code itself
+PIPELINE_STAGES = ["sections", "grade_aggregation", "ratings_output", "rmp_loading", "match_setup", "manual_matching", "direct_matching", "fuzzy_matching", "unmatched_output", "serialization", "store_export"]
+
+
+def generate_professors(count, rng):
+    """Generates synthetic professors with name collisions, middle initials, hyphenated and multi-part names."""
+    professors = []
+    for i in range(count):
+        if professors and rng.random() < 0.03: # a different person with the same name as someone else
+            namesake = rng.choice(professors)
+            first, last = namesake["first"], namesake["last"]
+        else:
+            first = rng.choice(FIRST_NAMES)
+            # common surnames on their own would make most names collide at larger scales, so most are made up from syllables
+            last = rng.choice(LAST_NAMES) if rng.random() < 0.3 else "".join(rng.choice(SURNAME_SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+            if rng.random() < 0.08:
+                last = f"{last}-{rng.choice(LAST_NAMES)}"
+        department = rng.choice(DEPARTMENTS)
+        professors.append({
+            "first": first,
+            "last": last,
+            "middle": rng.choice("ABCDEFGHJKLMNPRSTW") if rng.random() < 0.3 else None,
+            "instructor_id": f"{first[0]}{last[0]}{'x' if rng.random() < 0.5 else 'y'}{100000 + i:06d}".lower(),
+            "courses": sorted({f"{department}{rng.randrange(1, 7)}{rng.randrange(300):03d}" for _ in range(rng.randint(1, 5))}),
+        })
+    return professors
+
+
+def section_instructor_name(professor, rng):
+    """Returns how Coursebook lists a professor, sometimes with their middle initial."""
+    if professor["middle"] and rng.random() < 0.2:
+        return f"{professor['first']} {professor['middle']}. {professor['last']}"
+    return f"{professor['first']} {professor['last']}"
+
+
+def rmp_teacher_name(professor, rng):
+    """Returns the first and last name a professor goes by on RMP, which often differs a little from the Coursebook name."""
+    first, last = professor["first"], professor["last"]
+    roll = rng.random()
+    if roll < 0.06 and first in NICKNAMES:
+        first = NICKNAMES[first]
+    elif roll < 0.10 and "-" in last:
+        last = last.split("-")[rng.randrange(2)] # goes by one half of the hyphenated name
+    elif roll < 0.13 and " " in last:
+        last = last.split()[0]
+    elif roll < 0.15:
+        first, last = last, first # listed last name first
+    elif roll < 0.17:
+        first = first[:-1] if len(first) > 3 else first # typo
+    return first, last
+
+
+def generate_dataset(directory, scale=1, seed=0):
+    """Writes synthetic Coursebook sections, grade CSVs, RMP data and manual matches to a directory, returning the input sizes."""
+    rng = random.Random(seed)
+    professors = generate_professors(2500 * scale, rng)
+    for subdirectory in ("data/classes", "data/grades", "ratings", "matched", "unmatched"):
+        os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+
+    sizes = {"professors": len(professors), "sections": 0, "grade_rows": 0, "rmp_entries": 0}
+    for term, term_name in SYNTHETIC_TERMS:
+        sections = []
+        grade_rows = []
+        for professor in professors:
+            for course in professor["courses"]:
+                if rng.random() < 0.35:
+                    continue
+                prefix, number = course[:-4], course[-4:]
+                co_instructor = rng.choice(professors) if rng.random() < 0.1 else None
+                for section_number in range(1, rng.randint(1, 3) + 1):
+                    instructors = [section_instructor_name(professor, rng)] + ([section_instructor_name(co_instructor, rng)] if co_instructor else [])
+                    instructor_ids = [professor["instructor_id"]] + ([co_instructor["instructor_id"]] if co_instructor else [])
+                    sections.append({
+                        "section_address": f"{prefix.lower()}{number}.{section_number:03d}.{term}",
+                        "course_prefix": prefix.lower(),
+                        "course_number": number,
+                        "section": f"{section_number:03d} ",
+                        "title": f"{prefix} Topics {number} ",
+                        "instructors": ", ".join(instructors) + " ",
+                        "term": term,
+                        "days": rng.choice(["Monday, Wednesday", "Tuesday, Thursday", "Friday"]),
+                        "location": f"ECSS_{rng.randrange(1, 5)}.{rng.randrange(100, 999)}",
+                        "instructor_ids": ", ".join(instructor_ids),
+                    })
+                    counts = {grade: rng.randrange(12) if rng.random() < 0.7 else "" for grade in GRADE_FILE_COLUMNS[3:21]}
+                    if rng.random() < 0.03: # a section that only has CR/NC grades
+                        counts = {grade: "" for grade in counts} | {"CR": rng.randrange(1, 20)}
+                    grade_name = f"{professor['last']}, {professor['first']}" + (f" {professor['middle']}" if professor["middle"] else "") # the grade files list Last, First M
+                    grade_rows.append({"Subject": prefix, "Catalog Nbr": number, "Section": f"{section_number:03d}", **counts, "Instructor 1": grade_name})
+
+        with open(os.path.join(directory, "data/classes", f"classes_{term}.json"), "w", encoding="utf-8") as f:
+            json.dump(sections, f, indent=4)
+        with open(os.path.join(directory, "data/grades", f"{term_name}.csv"), "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=GRADE_FILE_COLUMNS)
+            writer.writeheader()
+            writer.writerows(grade_rows)
+        sizes["sections"] += len(sections)
+        sizes["grade_rows"] += len(grade_rows)
+
+    # most professors have an RMP profile, some have two and there are RMP profiles for people who never show up in the grade data
+    teachers = []
+    manual_matches = []
+    rmp_people = [professor for professor in professors if rng.random() < 0.85] + generate_professors(250 * scale, rng)
+    for position, professor in enumerate(rmp_people):
+        for profile in range(2 if rng.random() < 0.05 else 1):
+            first, last = rmp_teacher_name(professor, rng)
+            if position < len(rmp_people) - 250 * scale and not professor["middle"] and (first, last) != (professor["first"], professor["last"]) and len(manual_matches) < 5 * scale:
+                manual_matches.append({"ratings_name": f"{professor['first']} {professor['last']}", "rmp_name": f"{first} {last}"})
+            legacy_id = 100000 + len(teachers)
+            teachers.append({
+                "legacyId": legacy_id,
+                "firstName": first,
+                "lastName": last,
+                "department": professor["courses"][0][:-4],
+                "avgRating": round(rng.uniform(1, 5), 1),
+                "avgDifficulty": round(rng.uniform(1, 5), 1),
+                "wouldTakeAgainPercent": rng.uniform(0, 100),
+                "numRatings": rng.randrange(1, 200) // (profile + 1),
+                "courseCodes": [{"courseName": course, "courseCount": 1} for course in rng.sample(professor["courses"], rng.randint(1, len(professor["courses"])))],
+                "teacherRatingTags": [{"tagName": tag, "tagCount": rng.randrange(1, 30)} for tag in rng.sample(RMP_TAGS, rng.randint(0, 5))],
+            })
+
+    rmp_data = {}
+    for teacher in teachers:
+        professor_data = scraper.build_professor_data(teacher)
+        professor_data["courses"].sort() # the scraper dedupes them through a set, sorting keeps the generated files reproducible
+        professor_data["last_updated"] = "2025-01-01T00:00:00"
+        rmp_data.setdefault(scraper.normalize_professor_name(f"{teacher['firstName']} {teacher['lastName']}"), []).append(professor_data)
+    with open(os.path.join(directory, "ratings/rmp_ratings.json"), "w", encoding="utf-8") as f:
+        json.dump(rmp_data, f, indent=4, ensure_ascii=False)
+    sizes["rmp_entries"] = len(teachers)
+
+    with open(os.path.join(directory, "manual_matches.json"), "w", encoding="utf-8") as f:
+        json.dump(manual_matches, f, indent=4)
+    return sizes
+
+
+def benchmark_pipeline(data_dir, repeat=1, scorer="auto"):
+    """Times every stage of a full run on the inputs in data_dir, keeping the fastest time of each stage over the repeats."""
+    stages = {}
+    working_dir = os.getcwd()
+    os.chdir(data_dir) # the pipeline reads and writes paths relative to the working directory
+    try:
+        for _ in range(repeat):
+            reset_metrics()
+            with contextlib.redirect_stdout(io.StringIO()):
+                ratings = calculate_professor_ratings("data/grades", "data/classes", "ratings/grade_ratings.json", cache_dir=None)
+
+                stage_timer = start_stage("rmp_loading")
+                rmp_data = rmp_from_json(load_snapshot("ratings/rmp_ratings.json"))
+                end_stage(stage_timer)
+
+                matched_data = match_professor_names(ratings, rmp_data, scorer=scorer)
+
+                stage_timer = start_stage("serialization")
+                write_snapshot(iter_matched_records(matched_data), "matched/matched_professor_data.json")
+                end_stage(stage_timer)
+
+                stage_timer = start_stage("store_export")
+                export_store(iter_matched_records(matched_data))
+                end_stage(stage_timer)
+
+            timings = {stage: stage_seconds(stage) for stage in PIPELINE_STAGES}
+            for stage, seconds in timings.items():
+                stages[stage] = min(stages.get(stage, seconds), seconds)
+    finally:
+        os.chdir(working_dir)
+
+    return {
+        "scorer": resolve_scorer(scorer),
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "ratings_names": len(ratings),
+        "rmp_names": len(rmp_data),
+        "matched_names": len(matched_data),
+        "stages": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+        "total_seconds": round(sum(stages.values()), 4),
+    }
+
+
+def parse_import_times(importtime_output):
+    """Reads the -X importtime output into the cumulative import time of each module in microseconds, and of the top level imports."""
+    modules = {}
+    top_level = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit(): # the header line
+            continue
+        modules[name.strip()] = int(cumulative)
+        if name[1] != " ": # nested imports are indented under the module that imported them
+            top_level[name.strip()] = int(cumulative)
+    return modules, top_level
+
+
+def benchmark_imports(data_dir, mode_args=("reload",)):
+    """Runs main.py under python -X importtime on the inputs in data_dir and reports which of the heavier modules it imported."""
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), *mode_args], cwd=data_dir, capture_output=True, text=True)
+    run_seconds = time.perf_counter() - start_time
+    if result.returncode != 0:
+        raise RuntimeError(f"main.py {' '.join(mode_args)} failed:\n{result.stderr[-2000:]}")
+
+    modules, top_level = parse_import_times(result.stderr)
+    imported = {module: round(modules[module] / 1e6, 4) for module in REPORTED_IMPORTS if module in modules}
+    return {
+        "mode": " ".join(mode_args),
+        "run_seconds": round(run_seconds, 2),
+        "import_seconds": round(sum(top_level.values()) / 1e6, 4), # every import during the run, including the ones inside functions
+        "modules_imported": len(modules),
+        "heavy_modules_imported": imported,
+        "forbidden_imports": [module for module in RELOAD_FORBIDDEN_IMPORTS if module in modules],
+    }
+
+
+def run_main(data_dir, *mode_args):
+    """Runs main.py on the inputs in data_dir and returns what it printed."""
+    result = subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), *mode_args], cwd=data_dir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"main.py {' '.join(mode_args)} failed:\n{result.stderr[-2000:]}")
+    return result.stdout
+
+
+def read_match_outputs(data_dir):
+    """Reads the matched and unmatched JSON files in data_dir as bytes."""
+    outputs = []
+    for filename in ("matched/matched_professor_data.json", "unmatched/unmatched_ratings.json", "unmatched/unmatched_rmp.json"):
+        with open(os.path.join(data_dir, filename), "rb") as f:
+            outputs.append(f.read())
+    return outputs
+
+
+def check_replaced_outputs(data_dir):
+    """Checks an incremental match redoes the match instead of keeping matched files that a run without --incremental replaced."""
+    results = {}
+    run_main(data_dir, "reload", "--incremental")
+    expected = read_match_outputs(data_dir)
+
+    # a plain run on different grade ratings replaces the matched files, then the ratings go back to what the incremental match saw
+    ratings_file = os.path.join(data_dir, "ratings/grade_ratings.json")
+    ratings = load_snapshot(ratings_file)
+    write_snapshot({name: entries for name, entries in list(ratings.items())[1:]}, ratings_file)
+    run_main(data_dir, "reload")
+    write_snapshot(ratings, ratings_file)
+    output = run_main(data_dir, "reload", "--incremental")
+    results["rematched_after_replaced_inputs"] = "Nothing changed" not in output and read_match_outputs(data_dir) == expected
+
+    # the result of an incremental match is still reused when nothing replaced it
+    output = run_main(data_dir, "reload", "--incremental")
+    results["unchanged_match_reused"] = "Nothing changed" in output and read_match_outputs(data_dir) == expected
+
+    # both scorers write the same files, so the result stays the same whether or not a run with the other scorer came in between
+    if importlib.util.find_spec("rapidfuzz"):
+        run_main(data_dir, "reload", "--scorer", "fuzzywuzzy")
+        run_main(data_dir, "reload", "--incremental")
+        results["same_match_after_other_scorer"] = read_match_outputs(data_dir) == expected
+    return results
+
+
+def failed_checks(results, prefix=""):
+    """Lists the checks in a benchmark's results that came out False, a check being any true or false value."""
+    failed = []
+    for key, value in results.items():
+        if isinstance(value, dict):
+            failed.extend(failed_checks(value, f"{prefix}{key}."))
+        elif value is False:
+            failed.append(f"{prefix}{key}")
+    return failed
+
+
+def exit_on_failed_checks(results):
+    """Exits with status 1 after listing the checks in a benchmark's results that failed."""
+    failed = failed_checks(results)
+    if failed:
+        print(f"Failed checks: {', '.join(failed)}.")
+        exit(1)
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, noise_floor=0.05):
+    """Lists the stages that got slower than the baseline by more than the tolerance, ignoring differences below the noise floor in seconds."""
+    regressions = []
+    for stage, seconds in {**results["stages"], "total": results["total_seconds"]}.items():
+        baseline_seconds = baseline["total_seconds"] if stage == "total" else baseline["stages"].get(stage)
+        if baseline_seconds is None:
+            continue
+        if seconds > baseline_seconds * (1 + tolerance) and seconds - baseline_seconds > noise_floor:
+            regressions.append({"stage": stage, "baseline_seconds": baseline_seconds, "seconds": seconds, "slowdown": round(seconds / baseline_seconds, 2) if baseline_seconds else None})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Professor Data Matching Benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    fuzzy_parser = subparsers.add_parser("fuzzy", help="Benchmark the fuzzy matching phase")
+    fuzzy_parser.add_argument("--scale", type=int, nargs="+", default=[1, 10], help="Data size multipliers to benchmark")
+    fuzzy_parser.add_argument("--threshold", type=int, default=80, help="Fuzzy match threshold")
+    fuzzy_parser.add_argument("--exhaustive", action="store_true", help="Also time the full scan and check the matches are identical (slow)")
+
+    scorers_parser = subparsers.add_parser("scorers", help="Benchmark the name scorers on the fuzzy candidates and fail if their best matches differ")
+    scorers_parser.add_argument("--scale", type=int, nargs="+", default=[1], help="Data size multipliers to benchmark")
+    scorers_parser.add_argument("--threshold", type=int, default=80, help="Fuzzy match threshold")
+
+    matching_parser = subparsers.add_parser("matching", help="Benchmark a full matching pass")
+    matching_parser.add_argument("--scale", type=int, nargs="+", default=[1, 2, 4, 8], help="Data size multipliers to benchmark")
+    matching_parser.add_argument("--workers", type=int, default=1, help="Number of processes used for fuzzy matching")
+
+    sections_parser = subparsers.add_parser("sections", help="Benchmark the Coursebook section parsing")
+    sections_parser.add_argument("--section-dir", default="data/classes", help="Directory of Coursebook section files")
+
+    parsing_parser = subparsers.add_parser("parsing", help="Benchmark parsing the section and grade files with different numbers of workers")
+    parsing_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to benchmark")
+
+    scrape_parser = subparsers.add_parser("scrape", help="Benchmark scraping a local stub of the RMP GraphQL API")
+    scrape_parser.add_argument("--scale", type=int, default=1, help="Data size multiplier for the stub's teachers")
+    scrape_parser.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="Worker counts to benchmark")
+    scrape_parser.add_argument("--latency", type=float, default=0.2, help="Seconds the stub waits before answering each request")
+    scrape_parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of stub requests that fail with a 503")
+
+    snapshots_parser = subparsers.add_parser("snapshots", help="Benchmark writing and loading the ratings, unmatched and matched files in each snapshot format")
+    snapshots_parser.add_argument("--files", nargs="+", default=["ratings/grade_ratings.json", "ratings/rmp_ratings.json", "unmatched/unmatched_ratings.json", "unmatched/unmatched_rmp.json", "matched/matched_professor_data.json"], help="JSON artifacts to benchmark")
+
+    records_parser = subparsers.add_parser("records", help="Compare the memory of the ratings and RMP datasets as JSON dicts and as records")
+    records_parser.add_argument("--ratings-file", default="ratings/grade_ratings.json", help="Grade ratings file to load")
+    records_parser.add_argument("--rmp-file", default="ratings/rmp_ratings.json", help="RMP ratings file to load")
+
+    store_parser = subparsers.add_parser("store", help="Benchmark the SQLite professor store against scanning the matched JSON")
+    store_parser.add_argument("--queries", type=int, default=200, help="Number of name and course lookups to time")
+
+    grades_parser = subparsers.add_parser("grades", help="Benchmark reading the grade CSV rows")
+    grades_parser.add_argument("--grades-dir", default="data/grades", help="Directory of grade CSV files")
+
+    imports_parser = subparsers.add_parser("imports", help="Check with python -X importtime that reload mode doesn't import selenium and report what it does import")
+    imports_parser.add_argument("--scale", type=int, default=1, help="Data size multiplier of the synthetic inputs")
+    imports_parser.add_argument("--scorer", default="auto", choices=FUZZY_SCORERS, help="Name similarity scorer for fuzzy matching")
+    incremental_parser = subparsers.add_parser("incremental", help="Check that an incremental match doesn't keep matched files a run without --incremental replaced")
+    incremental_parser.add_argument("--scale", type=int, default=1, help="Data size multiplier of the synthetic inputs")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="Generate synthetic inputs and time every stage of a full run")
+    pipeline_parser.add_argument("--scale", type=int, default=1, help="Data size multiplier, 1 is about the size of the real data")
+    pipeline_parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data")
+    pipeline_parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the fastest one is kept")
+    pipeline_parser.add_argument("--scorer", default="auto", choices=FUZZY_SCORERS, help="Name similarity scorer for fuzzy matching")
+    pipeline_parser.add_argument("--data-dir", help="Directory to generate the inputs in and keep them, a temporary directory by default")
+    pipeline_parser.add_argument("--output", help="File to write the results to as JSON")
+    pipeline_parser.add_argument("--baseline", help="Results file from an earlier run to check for regressions against")
+    pipeline_parser.add_argument("--tolerance", type=float, default=0.25, help="Fraction a stage can slow down by before it counts as a regression")
+    args = parser.parse_args()
+
+    if args.benchmark == "sections":
+        print(f"Section parsing ({args.section_dir}):")
+        results = benchmark_section_parsing(args.section_dir)
+        print(json.dumps(results, indent=4))
+        if not results["latest_term_names"]:
+            print("An instructor ID goes by a name that isn't from the latest term it's listed in.")
+            exit(1)
+        return
+
+    if args.benchmark == "parsing":
+        for workers in args.workers:
+            print(f"Parsing with {workers} workers:")
+            print(json.dumps(benchmark_parsing(workers), indent=4))
+        return
+
+    if args.benchmark == "snapshots":
+        for filename in args.files:
+            print(f"Snapshot formats for {filename}:")
+            results = benchmark_snapshot(filename)
+            print(json.dumps(results, indent=4))
+            exit_on_failed_checks(results)
+        return
+
+    if args.benchmark == "records":
+        print("Entry memory as JSON dicts and as records:")
+        results = benchmark_records(args.ratings_file, args.rmp_file)
+        print(json.dumps(results, indent=4))
+        exit_on_failed_checks(results)
+        return
+
+    if args.benchmark == "store":
+        print("Professor store (matched/matched_professor_data.json):")
+        results = benchmark_store(queries=args.queries)
+        print(json.dumps(results, indent=4))
+        exit_on_failed_checks(results)
+        return
+
+    if args.benchmark == "grades":
+        print(f"Grade CSV rows ({args.grades_dir}):")
+        results = benchmark_grade_rows(args.grades_dir)
+        print(json.dumps(results, indent=4))
+        exit_on_failed_checks(results)
+        return
+
+    if args.benchmark == "imports":
+        with tempfile.TemporaryDirectory() as data_dir:
+            generate_dataset(data_dir, args.scale)
+            working_dir = os.getcwd()
+            os.chdir(data_dir)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    calculate_professor_ratings("data/grades", "data/classes", "ratings/grade_ratings.json", cache_dir=None)
+            finally:
+                os.chdir(working_dir)
+            results = benchmark_imports(data_dir, ("reload", "--scorer", args.scorer))
+        print(json.dumps(results, indent=4))
+        if results["forbidden_imports"]:
+            print(f"Reload mode imported {', '.join(results['forbidden_imports'])}.")
+            exit(1)
+        print("Reload mode didn't import selenium.")
+        return
+
+    if args.benchmark == "incremental":
+        with tempfile.TemporaryDirectory() as data_dir:
+            generate_dataset(data_dir, args.scale)
+            working_dir = os.getcwd()
+            os.chdir(data_dir)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    calculate_professor_ratings("data/grades", "data/classes", "ratings/grade_ratings.json", cache_dir=None)
+            finally:
+                os.chdir(working_dir)
+            results = check_replaced_outputs(data_dir)
+        print(json.dumps(results, indent=4))
+        exit_on_failed_checks(results)
+        print("Incremental matching never kept matched files another run replaced.")
+        return
+
+    if args.benchmark == "pipeline":
+        with contextlib.ExitStack() as stack:
+            data_dir = args.data_dir or stack.enter_context(tempfile.TemporaryDirectory())
+            start_time = time.time()
+            sizes = generate_dataset(data_dir, args.scale, args.seed)
+            print(f"Generated {sizes['professors']} professors, {sizes['sections']} sections, {sizes['grade_rows']} grade rows and {sizes['rmp_entries']} RMP entries in {time.time() - start_time:.2f} seconds.")
+            results = {"scale": args.scale, "seed": args.seed, "inputs": sizes, **benchmark_pipeline(data_dir, args.repeat, args.scorer)}
+        print(json.dumps(results, indent=4))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=4)
+            print(f"Results saved to {args.output}")
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+            regressions = compare_to_baseline(results, baseline, args.tolerance)
+            for regression in regressions:
+                print(f"Regression: {regression['stage']} took {regression['seconds']}s, {regression['baseline_seconds']}s in the baseline.")
+            if regressions:
+                exit(1)
+            print(f"No stage is more than {args.tolerance:.0%} slower than {args.baseline}.")
+        return
+
+    ratings, rmp_data = load_benchmark_data()
+
+    if args.benchmark == "fuzzy":
+        for scale in args.scale:
+            ratings_names = scale_names(list(ratings.keys()), scale, seed=1)
+            rmp_names = scale_names(list(rmp_data.keys()), scale, seed=2)
+            print(f"Fuzzy phase at {scale}x ({len(ratings_names)} ratings names, {len(rmp_names)} RMP names):")
+            results = benchmark_fuzzy_phase(ratings_names, rmp_names, args.threshold, args.exhaustive)
+            print(json.dumps(results, indent=4))
+            exit_on_failed_checks(results)
+
+    elif args.benchmark == "scorers":
+        for scale in args.scale:
+            ratings_names = scale_names(list(ratings.keys()), scale, seed=1)
+            rmp_names = scale_names(list(rmp_data.keys()), scale, seed=2)
+            print(f"Name scorers at {scale}x ({len(ratings_names)} ratings names, {len(rmp_names)} RMP names):")
+            results = benchmark_scorers(ratings_names, rmp_names, args.threshold)
+            print(json.dumps(results, indent=4))
+            if "rapidfuzz" not in results:
+                print("rapidfuzz isn't installed, there is nothing to compare fuzzywuzzy to.")
+                continue
+            if not results["rapidfuzz"]["identical_to_pairwise"]:
+                print("The rapidfuzz batch scores picked different matches than scoring every pair on its own.")
+                exit(1)
+            for difference in results["different_best_matches"]:
+                print(f"Mismatch: {difference['name']} is matched to {difference['fuzzywuzzy'][0]} ({difference['fuzzywuzzy'][1]}) by fuzzywuzzy and to {difference['rapidfuzz'][0]} ({difference['rapidfuzz'][1]}) by rapidfuzz.")
+            if results["different_best_matches"]:
+                exit(1)
+            print("fuzzywuzzy and rapidfuzz picked the same best match and score for every name.")
+
+    elif args.benchmark == "scrape":
+        _, scaled_rmp_data = scale_dataset(ratings, rmp_data, args.scale, seed=1)
+        for workers in args.workers:
+            print(f"Scraping the stub API at {args.scale}x with {workers} workers:")
+            results = benchmark_scrape(scaled_rmp_data, workers, args.latency, args.failure_rate)
+            print(json.dumps(results, indent=4))
+            exit_on_failed_checks(results)
+
+    elif args.benchmark == "matching":
+        for scale in args.scale:
+            scaled_ratings, scaled_rmp_data = scale_dataset(ratings, rmp_data, scale, seed=1)
+            print(f"Matching at {scale}x:")
+            results = benchmark_matching(ratings_from_json(scaled_ratings), rmp_from_json(scaled_rmp_data), args.workers)
+            print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
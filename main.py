@@ -1,12 +1,24 @@
 import json
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
+import hashlib
+import importlib.util
 import argparse
 import time
 import re
 import os
-from scraper import scrape_rmp_data
-from aggregator import calculate_professor_ratings, normalize_name
+from array import array
+from collections import Counter
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from aggregator import build_name_maps, calculate_professor_ratings, normalize_name
+from parse_cache import CACHE_DIR, clear_cache, describe_cache
+from snapshot import SNAPSHOT_FORMATS, load_snapshot, snapshot_filename, write_snapshot
+from store import STORE_FILE, export_store
+from metrics import count, end_stage, save_metrics, start_stage
+from records import MatchedProfessor, iter_json_records, ratings_from_json, rmp_from_json
+
+MATCH_STATE_FILE = "matched/match_state.json" # fingerprints and fuzzy matches of the last incremental match
+MATCH_STATE_VERSION = 5
+
 
 def extract_course_department(course_code):
     """Extracts the department from a course code."""
@@ -41,26 +53,287 @@ def generate_name_variations(name):
     return variations
 
 
-def check_course_overlap(rmp_info, ratings_info):
+def name_bigrams(name):
+    """Lists the character bigrams in a name, numbering repeats so that shared bigrams can be counted as a set intersection."""
+    bigrams = []
+    seen = {}
+    for i in range(len(name) - 1):
+        bigram = name[i:i + 2]
+        seen[bigram] = seen.get(bigram, 0) + 1
+        bigrams.append((bigram, seen[bigram]))
+    return bigrams
+
+
+# fuzzy matching used to score every ratings name against every RMP name, so the index narrows that down to names that can actually reach the threshold
+# different RMP names often share variations (i.e. "ali mohammed" is a variation of both "ali mohammed" and "mohammed ali"), so each distinct variation
+# is stored and scored once and its score is handed to every RMP name that owns it
+def build_candidate_index(normalized_rmp_data):
+    """Builds a bigram index over the distinct variations of every normalized RMP name."""
+    candidate_index = {
+        "names": list(normalized_rmp_data.keys()),
+        "variations": [], # each distinct variation once
+        "lengths": array("i"), # length of each variation
+        "owner_starts": array("i", [0]), # the owners of variation i are owner_positions[owner_starts[i]:owner_starts[i + 1]]
+        "owner_positions": array("i"), # positions of the RMP names each variation belongs to, in RMP name order
+        "postings": {}, # numbered bigram -> list of variation ids
+    }
+    variation_ids = {}
+    owners = []
+    for position, rmp_norm in enumerate(candidate_index["names"]):
+        for rmp_variation in generate_name_variations(rmp_norm):
+            variation_id = variation_ids.get(rmp_variation)
+            if variation_id is None:
+                variation_id = variation_ids[rmp_variation] = len(candidate_index["variations"])
+                candidate_index["variations"].append(rmp_variation)
+                candidate_index["lengths"].append(len(rmp_variation))
+                owners.append([])
+                for bigram in name_bigrams(rmp_variation):
+                    candidate_index["postings"].setdefault(bigram, []).append(variation_id)
+            owners[variation_id].append(position)
+
+    for variation_owners in owners:
+        candidate_index["owner_positions"].extend(variation_owners)
+        candidate_index["owner_starts"].append(len(candidate_index["owner_positions"]))
+    return candidate_index
+
+
+def variation_owners(candidate_index, variation_id):
+    """Returns the positions of the RMP names a variation belongs to."""
+    return candidate_index["owner_positions"][candidate_index["owner_starts"][variation_id]:candidate_index["owner_starts"][variation_id + 1]]
+
+
+def find_fuzzy_candidates(candidate_index, ratings_variations, fuzzy_threshold):
+    """Finds the distinct (ratings variation, RMP variation id) pairs that could score at least fuzzy_threshold."""
+    # fuzz.ratio is 2 * matches / total length and the matched characters form a common subsequence, so a pair that reaches the threshold
+    # needs enough length in common and enough shared bigrams (every gap in the alignment breaks at most one bigram), skipping these loses nothing
+    min_ratio = (fuzzy_threshold - 0.5) / 100 - 1e-9 # scores are rounded, so 79.5 already counts as 80
+    bigram_factor = 1.5 * min_ratio - 1
+    max_length = max(candidate_index["lengths"], default=0)
+    postings = candidate_index["postings"]
+    candidates = []
+
+    for ratings_variation in ratings_variations:
+        ratings_length = len(ratings_variation)
+        required_bigrams = []
+        short_lengths = set()
+        for rmp_length in range(max_length + 1):
+            total_length = ratings_length + rmp_length
+            if 2 * min(ratings_length, rmp_length) < min_ratio * total_length:
+                required_bigrams.append(float("inf"))
+            else:
+                required_bigrams.append(total_length * bigram_factor - 1)
+                if required_bigrams[-1] <= 0: # very short names can reach the threshold without sharing any bigrams
+                    short_lengths.add(rmp_length)
+
+        shared_bigrams = Counter(chain.from_iterable(postings.get(bigram, ()) for bigram in name_bigrams(ratings_variation)))
+        if short_lengths:
+            for variation_id, rmp_length in enumerate(candidate_index["lengths"]):
+                if rmp_length in short_lengths:
+                    shared_bigrams[variation_id] += 0
+
+        for variation_id, shared in shared_bigrams.items():
+            if shared >= required_bigrams[candidate_index["lengths"][variation_id]]:
+                candidates.append((ratings_variation, variation_id))
+
+    return candidates
+
+
+# fuzzywuzzy runs on pure python difflib unless python-Levenshtein is installed, rapidfuzz scores in C and can score a whole batch of names in one call.
+# difflib's matching blocks never add up to more than the longest common subsequence, so rapidfuzz's indel score is an upper bound on fuzz.ratio. the
+# rapidfuzz scorer uses it to rule out the pairs that can't reach the threshold and scores the rest with fuzz.ratio, so both scorers match the same
+FUZZY_SCORERS = ("auto", "rapidfuzz", "fuzzywuzzy")
+
+
+def resolve_scorer(scorer="auto"):
+    """Picks the rapidfuzz scorer when rapidfuzz is installed and the fuzzywuzzy one otherwise."""
+    if scorer == "auto":
+        return "rapidfuzz" if importlib.util.find_spec("rapidfuzz") else "fuzzywuzzy"
+    return scorer
+
+
+def indel_ratio(s1, s2, distance):
+    """Turns the indel distance of two names into the same rounded 0-100 score as fuzz.ratio."""
+    total_length = len(s1) + len(s2)
+    if total_length == 0:
+        return 100
+    return round(100 * ((total_length - distance) / total_length)) # the same float operations as fuzz.ratio so the rounding agrees
+
+
+def fuzzy_ratio(s1, s2, scorer="fuzzywuzzy", fuzzy_threshold=0):
+    """Scores a single pair of names with the given scorer, the rapidfuzz one gives 0 to a pair that can't reach the threshold."""
+    from fuzzywuzzy import fuzz
+    if scorer == "rapidfuzz":
+        from rapidfuzz.distance import Indel
+        if indel_ratio(s1, s2, Indel.distance(s1, s2)) < fuzzy_threshold:
+            return 0
+    return fuzz.ratio(s1, s2)
+
+
+def find_best_fuzzy_match(ratings_norm, normalized_rmp_data, fuzzy_threshold, candidate_index=None, scorer="fuzzywuzzy", counters=None):
+    """Finds the best fuzzy matching RMP name for a ratings name, scanning every RMP name if no candidate index is given."""
+    best_match = None
+    best_score = 0
+
+    if candidate_index is None:
+        ratings_variations = generate_name_variations(ratings_norm)
+        for rmp_norm in normalized_rmp_data:
+            for ratings_variation in ratings_variations:
+                for rmp_variation in generate_name_variations(rmp_norm):
+                    score = fuzzy_ratio(ratings_variation, rmp_variation, scorer, fuzzy_threshold)
+
+                    if score > best_score and score >= fuzzy_threshold:
+                        best_score = score
+                        best_match = rmp_norm
+        return best_match, best_score
+
+    candidates = find_fuzzy_candidates(candidate_index, generate_name_variations(ratings_norm), fuzzy_threshold)
+    return score_fuzzy_candidates(candidate_index, candidates, fuzzy_threshold, scorer, counters)
+
+
+def score_candidates_rapidfuzz(candidate_index, candidates, fuzzy_threshold):
+    """Scores the candidate variation pairs with one rapidfuzz call and fuzz.ratio on the ones that can reach the threshold, returning the scores in the same order as the candidates."""
+    from fuzzywuzzy import fuzz
+    from rapidfuzz.distance import Indel
+    from rapidfuzz.process import cdist
+
+    variations = candidate_index["variations"]
+    queries = list(dict.fromkeys(ratings_variation for ratings_variation, _ in candidates))
+    choices = list(dict.fromkeys(variations[variation_id] for _, variation_id in candidates))
+    # no pair that can reach the threshold is further apart than this, so cdist gives up early on everything else and reports cutoff + 1 for it
+    min_ratio = (fuzzy_threshold - 0.5) / 100
+    cutoff = int((max(map(len, queries)) + max(map(len, choices))) * (1 - min_ratio)) + 1
+    distances = cdist(queries, choices, scorer=Indel.distance, score_cutoff=cutoff)
+    query_ids = {query: i for i, query in enumerate(queries)}
+    choice_ids = {choice: i for i, choice in enumerate(choices)}
+
+    scores = []
+    for ratings_variation, variation_id in candidates:
+        rmp_variation = variations[variation_id]
+        distance = int(distances[query_ids[ratings_variation], choice_ids[rmp_variation]])
+        if distance <= cutoff and indel_ratio(ratings_variation, rmp_variation, distance) >= fuzzy_threshold:
+            scores.append(fuzz.ratio(ratings_variation, rmp_variation))
+        else:
+            scores.append(0)
+    return scores
+
+
+def score_fuzzy_candidates(candidate_index, candidates, fuzzy_threshold, scorer="fuzzywuzzy", counters=None):
+    """Scores the candidate variation pairs and returns the best matching RMP name along with its score."""
+    if not candidates:
+        return None, 0
+
+    if scorer == "rapidfuzz":
+        scores = score_candidates_rapidfuzz(candidate_index, candidates, fuzzy_threshold)
+    else:
+        from fuzzywuzzy import fuzz
+        scores = [fuzz.ratio(ratings_variation, candidate_index["variations"][variation_id]) for ratings_variation, variation_id in candidates]
+    return best_owner_match(candidate_index, candidates, scores, fuzzy_threshold, counters)
+
+
+def best_owner_match(candidate_index, candidates, scores, fuzzy_threshold, counters=None):
+    """Hands the score of each variation pair to the RMP names that own the variation and returns the best matching name along with its score."""
+    position_scores = {}
+    owned_pairs = 0
+    for (_, variation_id), score in zip(candidates, scores):
+        owners = variation_owners(candidate_index, variation_id)
+        owned_pairs += len(owners)
+        if score >= fuzzy_threshold:
+            for position in owners:
+                if score > position_scores.get(position, 0):
+                    position_scores[position] = score
+
+    if counters is not None: # every owner of a variation used to score it separately
+        counters["ratio_calls"] += len(candidates)
+        counters["ratio_calls_saved"] += owned_pairs - len(candidates)
+
+    # the first RMP name with the highest score wins, which is how ties resolved when every name was scanned in order
+    best_match = None
+    best_score = 0
+    for position in sorted(position_scores):
+        if position_scores[position] > best_score:
+            best_score = position_scores[position]
+            best_match = candidate_index["names"][position]
+
+    return best_match, best_score
+
+
+# each worker process receives the candidate index once when it starts rather than with every name
+fuzzy_worker_state = {}
+
+
+def init_fuzzy_worker(candidate_index, fuzzy_threshold, scorer):
+    """Stores the candidate index, threshold and scorer in a fuzzy matching worker process."""
+    fuzzy_worker_state["candidate_index"] = candidate_index
+    fuzzy_worker_state["fuzzy_threshold"] = fuzzy_threshold
+    fuzzy_worker_state["scorer"] = scorer
+
+
+def fuzzy_match_worker(ratings_norm):
+    """Finds the best fuzzy match for a ratings name inside a worker process, along with the ratio call counts."""
+    candidate_index = fuzzy_worker_state["candidate_index"]
+    fuzzy_threshold = fuzzy_worker_state["fuzzy_threshold"]
+    counters = {"ratio_calls": 0, "ratio_calls_saved": 0}
+    candidates = find_fuzzy_candidates(candidate_index, generate_name_variations(ratings_norm), fuzzy_threshold)
+    return score_fuzzy_candidates(candidate_index, candidates, fuzzy_threshold, fuzzy_worker_state["scorer"], counters), counters
+
+
+def find_fuzzy_matches(ratings_norms, normalized_rmp_data, fuzzy_threshold, candidate_index, workers=1, scorer="fuzzywuzzy", counters=None):
+    """Finds the best fuzzy match for each ratings name, splitting the names across worker processes if requested."""
+    if workers <= 1 or len(ratings_norms) < 2:
+        return [find_best_fuzzy_match(ratings_norm, normalized_rmp_data, fuzzy_threshold, candidate_index, scorer, counters) for ratings_norm in ratings_norms]
+
+    # the best match for a name only depends on the name and the index, so the results can be computed in any process and are returned in input order
+    chunksize = max(1, len(ratings_norms) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_fuzzy_worker, initargs=(candidate_index, fuzzy_threshold, scorer)) as executor:
+        results = list(executor.map(fuzzy_match_worker, ratings_norms, chunksize=chunksize))
+    if counters is not None:
+        for _, worker_counters in results:
+            for key, value in worker_counters.items():
+                counters[key] += value
+    return [match for match, _ in results]
+
+
+def parse_course_profile(courses):
+    """Parses course codes into the sets of courses, departments and course numbers that overlap checks compare."""
+    courses = frozenset(courses)
+    departments = frozenset(department for department in map(extract_course_department, courses) if department)
+    numbers = frozenset(re.sub(r'[^\d]', '', course) for course in courses)
+    return courses, departments, numbers
+
+
+# the same entries are checked against several candidates, so their course sets are parsed once per match run and kept by entry identity,
+# the entries stay referenced by the datasets for the whole run so their ids can't be reused while the cache is alive
+def get_course_profile(entry, courses, course_profiles):
+    """Returns the parsed course sets of an entry, parsing them on the first lookup."""
+    if course_profiles is None:
+        return parse_course_profile(courses)
+    profile = course_profiles.get(id(entry))
+    if profile is None:
+        profile = course_profiles[id(entry)] = parse_course_profile(courses)
+    return profile
+
+
+def check_course_overlap(rmp_info, ratings_info, course_profiles=None):
     """Checks for course overlap between RMP and ratings data."""
-    rmp_courses = set(rmp_info.get("courses", []))
-    ratings_courses = set(ratings_info.get("course_ratings", {}).keys())
+    count("check_course_overlap_calls")
+    rmp_courses, rmp_headers, rmp_numbers = get_course_profile(rmp_info, rmp_info.courses, course_profiles)
+    ratings_courses, ratings_headers, ratings_numbers = get_course_profile(ratings_info, ratings_info.course_ratings.keys(), course_profiles)
 
-    rmp_headers = {extract_course_department(course) for course in rmp_courses if extract_course_department(course)}
-    ratings_headers = {extract_course_department(course) for course in ratings_courses if extract_course_department(course)}
+    return not rmp_courses.isdisjoint(ratings_courses) or not rmp_headers.isdisjoint(ratings_headers) or not rmp_numbers.isdisjoint(ratings_numbers)
 
-    rmp_numbers = {re.sub(r'[^\d]', '', course) for course in rmp_courses}
-    ratings_numbers = {re.sub(r'[^\d]', '', course) for course in ratings_courses}
 
-    return rmp_courses.intersection(ratings_courses) or rmp_headers.intersection(ratings_headers) or rmp_numbers.intersection(ratings_numbers)
+# matches are kept as MatchedProfessor records that point at the input entries, and the merged output entry is only built when it's written
+def iter_matched_records(matched_data):
+    """Yields each professor name with its output entries, merging the matched records one name at a time."""
+    for name, professors in matched_data.items():
+        yield name, [professor.to_json() for professor in professors]
 
 
 # direct match is when the names are exactly the same, or when the names are effectively the same after normalization
-def process_direct_match(ratings_list, rmp_list):
-    """Processes a direct match and returns the matched data."""
+def process_direct_match(ratings_list, rmp_list, course_profiles=None):
+    """Processes a direct match and returns the matched professor."""
     if len(ratings_list) == 1 and len(rmp_list) == 1: # if there's only one entry in each list, we can assume they are the same person and match them directly
-        rmp_info_cleaned = {k: v for k, v in rmp_list[0].items() if k != "courses"}
-        return {**rmp_info_cleaned, **ratings_list[0]}
+        return MatchedProfessor(rmp_list[0], ratings_list[0])
 
     # if there are multiple entries, we need to find the most likely match based on the courses taught by each and the number of ratings (sometimes the same prof has multiple RMP profiles so this selects the most used one effectively)
     best_rmp_match = None
@@ -69,34 +342,66 @@ def process_direct_match(ratings_list, rmp_list):
 
     for ratings_info in ratings_list:
         for rmp_info in rmp_list:
-            if check_course_overlap(rmp_info, ratings_info):
-                score = rmp_info.get("ratings_count", 0)
+            if check_course_overlap(rmp_info, ratings_info, course_profiles):
+                score = rmp_info.ratings_count
                 if score > best_rmp_score:
                     best_rmp_score = score
                     best_rmp_match = rmp_info
                     best_ratings_match = ratings_info
 
     if best_rmp_match:
-        rmp_info_cleaned = {k: v for k, v in best_rmp_match.items() if k != "courses"} # remove the RMP course list from the final data since the courses are already in the ratings data
-        return {**rmp_info_cleaned, **best_ratings_match}
+        return MatchedProfessor(best_rmp_match, best_ratings_match)
 
     return None
 
 
-def remove_matched_entries(matched_ratings_entry, matched_rmp_entry, ratings, rmp_data):
-    """Removes the specific matched entries from ratings and rmp_data."""
-    for ratings_key, ratings_list in list(ratings.items()):
-        ratings[ratings_key] = [entry for entry in ratings_list if entry.get("instructor_id") != matched_ratings_entry.get("instructor_id")] # use the instructor_id to remove the proper entry from the list of profs with that name
-        if not ratings[ratings_key]:
-            del ratings[ratings_key]
-    for rmp_key, rmp_list in list(rmp_data.items()):
-        rmp_data[rmp_key] = [entry for entry in rmp_list if entry.get("rmp_id") != matched_rmp_entry.get("rmp_id")] # use the rmp_id to remove the proper entry from the list of profs with that name
-        if not rmp_data[rmp_key]:
-            del rmp_data[rmp_key]
+# matched entries used to be removed by rebuilding every list in both datasets, the pools index the remaining entries by id so removal is constant time
+def build_remaining_pool(data, id_key):
+    """Indexes the entries of a name keyed dataset by id so that matched entries can be removed without rescanning the dataset."""
+    pool = {
+        "id_key": id_key,
+        "names": {}, # name -> {position in the original list: entry} for the entries that are still unmatched
+        "ids": {}, # id -> list of (name, position) for every entry with that id
+    }
+    for name, entries in data.items():
+        pool["names"][name] = {}
+        for position, entry in enumerate(entries):
+            pool["names"][name][position] = entry
+            pool["ids"].setdefault(getattr(entry, id_key), []).append((name, position))
+        if not pool["names"][name]:
+            del pool["names"][name]
+    return pool
+
+
+def remove_from_pool(pool, matched_entry):
+    """Removes every remaining entry that shares the matched entry's id."""
+    for name, position in pool["ids"].pop(getattr(matched_entry, pool["id_key"]), []):
+        del pool["names"][name][position]
+        if not pool["names"][name]:
+            del pool["names"][name]
+
+
+def remaining_entries(pool):
+    """Returns the entries left in a pool as a name keyed dataset in the original order."""
+    return {name: list(entries.values()) for name, entries in pool["names"].items()}
+
+
+def find_original_name(normalized_name, original_names, pool):
+    """Finds the first original name with the given normalized form that still has entries in the pool."""
+    for original_name in original_names.get(normalized_name, []):
+        if original_name in pool["names"]:
+            return original_name
+    return None
+
+
+def remove_matched_entries(matched_entry, ratings_pool, rmp_pool):
+    """Removes the specific matched entries from the remaining ratings and RMP pools."""
+    remove_from_pool(ratings_pool, matched_entry.ratings) # use the instructor_id to remove the proper entry from the list of profs with that name
+    remove_from_pool(rmp_pool, matched_entry.rmp) # use the rmp_id to remove the proper entry from the list of profs with that name
 
 
 # applies manual matches from a JSON file, i.e. Yu Chung Ng is Vincent Ng in RMP so that matching is done from deliberate user input
-def apply_manual_matches(ratings, rmp_data, matched_data, normalized_ratings, normalized_rmp_data):
+def apply_manual_matches(ratings_pool, rmp_pool, matched_data, normalized_ratings, normalized_rmp_data, original_rmp_names, course_profiles=None):
     """Applies manual matches from a JSON file, normalizing names before matching."""
     try:
         with open("manual_matches.json", "r", encoding="utf-8") as f:
@@ -114,20 +419,16 @@ def apply_manual_matches(ratings, rmp_data, matched_data, normalized_ratings, no
             original_ratings_name, ratings_list = normalized_ratings[ratings_name]
             rmp_list = normalized_rmp_data[rmp_name]
 
-            matched_entry = process_direct_match(ratings_list, rmp_list)
+            matched_entry = process_direct_match(ratings_list, rmp_list, course_profiles)
 
             if matched_entry:
                 if original_ratings_name not in matched_data:
                     matched_data[original_ratings_name] = []
                 matched_data[original_ratings_name].append(matched_entry)
-                original_rmp_name = None
-                for original_name, norm_data in rmp_data.items():
-                    if normalize_name(original_name) == rmp_name:
-                        original_rmp_name = original_name
-                        break
-
-                if original_ratings_name in ratings and original_rmp_name in rmp_data:
-                    remove_matched_entries(matched_entry, matched_entry, ratings, rmp_data)
+                original_rmp_name = find_original_name(rmp_name, original_rmp_names, rmp_pool)
+
+                if original_ratings_name in ratings_pool["names"] and original_rmp_name in rmp_pool["names"]:
+                    remove_matched_entries(matched_entry, ratings_pool, rmp_pool)
                     print(f"Manual match applied: {original_ratings_name} -> {original_rmp_name}")
                 else:
                     print(f"Manual match failed: Could not find entries in source dictionaries.")
@@ -138,176 +439,471 @@ def apply_manual_matches(ratings, rmp_data, matched_data, normalized_ratings, no
 
 
 # main match logic driver function
-def match_professor_names(ratings, rmp_data, fuzzy_threshold=80):
-    """Matches professor data, handles name variations, and saves unmatched names."""
+def match_professor_names(ratings, rmp_data, fuzzy_threshold=80, workers=1, fuzzy_cache=None, snapshot_format="json", scorer="auto"):
+    """Matches professor data, handles name variations, and saves unmatched names. Returns the matched professor records of every name, see iter_matched_records."""
+    stage_timer = start_stage("match_setup")
     matched_data = {}
+    scorer = resolve_scorer(scorer)
     ratings_to_append = list(ratings.keys())
     matched_names = set()
 
-    normalized_ratings = {normalize_name(name): (name, data) for name, data in ratings.items()}
-    normalized_rmp_data = {normalize_name(name): data for name, data in rmp_data.items()}
+    normalized_ratings_names, _ = build_name_maps(ratings)
+    normalized_rmp_names, original_rmp_names = build_name_maps(rmp_data)
+    normalized_ratings = {normalized_ratings_names[name]: (name, data) for name, data in ratings.items()}
+    normalized_rmp_data = {normalized_rmp_names[name]: data for name, data in rmp_data.items()}
+    ratings_pool = build_remaining_pool(ratings, "instructor_id")
+    rmp_pool = build_remaining_pool(rmp_data, "rmp_id")
+    course_profiles = {} # id of an entry -> its parsed course sets
+    end_stage(stage_timer, items=len(ratings) + len(rmp_data))
 
-    apply_manual_matches(ratings, rmp_data, matched_data, normalized_ratings, normalized_rmp_data) # apply manual matches before processing
+    stage_timer = start_stage("manual_matching")
+    apply_manual_matches(ratings_pool, rmp_pool, matched_data, normalized_ratings, normalized_rmp_data, original_rmp_names, course_profiles) # apply manual matches before processing
+    end_stage(stage_timer, items=len(matched_data))
 
     total_ratings_entries = sum(len(data_list) for _, data_list in normalized_ratings.values())
     total_rmp_entries = sum(len(rmp_list) for _, rmp_list in normalized_rmp_data.items())
     print(f"Now matching {total_ratings_entries} grade ratings entries to {total_rmp_entries} RateMyProfessors entries...")
 
     direct_match_count = 0
+    stage_timer = start_stage("direct_matching")
 
     for rmp_norm, rmp_list in normalized_rmp_data.items():
         if rmp_norm in normalized_ratings:
             original_ratings_name, ratings_list = normalized_ratings[rmp_norm]
-            matched_entry = process_direct_match(ratings_list, rmp_list)
+            matched_entry = process_direct_match(ratings_list, rmp_list, course_profiles)
 
             if matched_entry:
                 if original_ratings_name not in matched_data:
                     matched_data[original_ratings_name] = []
                 matched_data[original_ratings_name].append(matched_entry)
-                original_rmp_name = None
-                for original_name, norm_data in rmp_data.items():
-                    if normalize_name(original_name) == rmp_norm:
-                        original_rmp_name = original_name
-                        break
+                original_rmp_name = find_original_name(rmp_norm, original_rmp_names, rmp_pool)
 
                 if original_rmp_name is None:
                     print(f"Warning: Original RMP name not found for normalized name {rmp_norm}.")
                     continue
 
-                if original_ratings_name in ratings and original_rmp_name in rmp_data:
-                    remove_matched_entries(matched_entry, matched_entry, ratings, rmp_data)
+                if original_ratings_name in ratings_pool["names"] and original_rmp_name in rmp_pool["names"]:
+                    remove_matched_entries(matched_entry, ratings_pool, rmp_pool)
                     matched_names.add(original_ratings_name)
                     direct_match_count += 1
 
+    end_stage(stage_timer, items=direct_match_count)
     print(f"Direct Matches: {direct_match_count}")
     print(f"Remaining Ratings to Fuzzy Match: {len(normalized_ratings)}, now matching...")
 
-    for original_ratings_name, ratings_list in list(ratings.items()):
-        if original_ratings_name not in ratings:
+    stage_timer = start_stage("fuzzy_matching")
+    fuzzy_ratings = list(remaining_entries(ratings_pool).items())
+    fuzzy_norms = [normalized_ratings_names[name] for name, _ in fuzzy_ratings]
+
+    # a fuzzy cache holds the best matches from an earlier run that are still valid for these RMP names, so only the other names are scored
+    # names that normalize the same way are only scored once
+    if fuzzy_cache is None:
+        fuzzy_cache = {}
+        missing_norms = list(dict.fromkeys(fuzzy_norms))
+    else:
+        missing_norms = [ratings_norm for ratings_norm in dict.fromkeys(fuzzy_norms) if ratings_norm not in fuzzy_cache]
+        print(f"Reusing {len(set(fuzzy_norms)) - len(missing_norms)} fuzzy matches from the last run, scoring {len(missing_norms)} names.")
+    if missing_norms:
+        fuzzy_counters = {"ratio_calls": 0, "ratio_calls_saved": 0}
+        missing_matches = find_fuzzy_matches(missing_norms, normalized_rmp_data, fuzzy_threshold, build_candidate_index(normalized_rmp_data), workers, scorer, fuzzy_counters)
+        fuzzy_cache.update(zip(missing_norms, missing_matches))
+        count("fuzz_ratio_calls", fuzzy_counters["ratio_calls"])
+        count("fuzz_ratio_calls_saved", fuzzy_counters["ratio_calls_saved"])
+        print(f"Scored {fuzzy_counters['ratio_calls']} distinct name variation pairs, {fuzzy_counters['ratio_calls_saved']} ratio calls saved on variations shared by several RMP names.")
+    fuzzy_matches = [fuzzy_cache[ratings_norm] for ratings_norm in fuzzy_norms]
+
+    # the matches are applied in the same order as before so the output doesn't depend on the number of workers
+    for (original_ratings_name, ratings_list), (best_match, best_score) in zip(fuzzy_ratings, fuzzy_matches):
+        if original_ratings_name not in ratings_pool["names"]:
             continue
-        ratings_norm = normalize_name(original_ratings_name)
-        best_match = None
-        best_score = 0
-
         ratings_info = ratings_list[0]
 
-        for rmp_norm, rmp_list in normalized_rmp_data.items():
-            for ratings_variation in generate_name_variations(ratings_norm):
-                for rmp_variation in generate_name_variations(rmp_norm):
-                    score = fuzz.ratio(ratings_variation, rmp_variation)
-
-                    if score > best_score and score >= fuzzy_threshold:
-                        best_score = score
-                        best_match = rmp_norm
-
         if best_match:
             best_rmp_match = None
             best_rmp_score = 0
 
             for rmp_info in normalized_rmp_data[best_match]:
-                if check_course_overlap(rmp_info, ratings_info):
-                    score = rmp_info.get("ratings_count", 0)
+                if check_course_overlap(rmp_info, ratings_info, course_profiles):
+                    score = rmp_info.ratings_count
                     if score > best_rmp_score:
                         best_rmp_score = score
                         best_rmp_match = rmp_info
 
             if best_rmp_match:
-                rmp_info_cleaned = {k: v for k, v in best_rmp_match.items() if k not in ["courses"]}
                 if original_ratings_name not in matched_data:
                     matched_data[original_ratings_name] = []
-                matched_data[original_ratings_name].append({**rmp_info_cleaned, **ratings_info})
-                original_rmp_name = None
-                for original_name, norm_data in rmp_data.items():
-                    if normalize_name(original_name) == best_match:
-                        original_rmp_name = original_name
-                        break
+                matched_entry = MatchedProfessor(best_rmp_match, ratings_info)
+                matched_data[original_ratings_name].append(matched_entry)
+                original_rmp_name = find_original_name(best_match, original_rmp_names, rmp_pool)
 
                 if original_rmp_name is None:
                     print(f"Warning: Original RMP name not found for normalized name {best_match}.")
                     continue
 
-                if original_ratings_name in ratings and original_rmp_name in rmp_data:
-                    remove_matched_entries(ratings_info, best_rmp_match, ratings, rmp_data)
+                if original_ratings_name in ratings_pool["names"] and original_rmp_name in rmp_pool["names"]:
+                    remove_matched_entries(matched_entry, ratings_pool, rmp_pool)
                     matched_names.add(original_ratings_name)
                 else:
                     print(f"Fuzzy match rejected for {original_ratings_name} due to no matching courses.")
-                    remove_matched_entries(ratings_info, best_rmp_match, ratings, rmp_data)
+                    remove_matched_entries(matched_entry, ratings_pool, rmp_pool)
             else:
                 print(f"Fuzzy match rejected for {original_ratings_name} due to no matching RMP professor with shared courses.")
         else:
             print(f"Fuzzy match rejected for {original_ratings_name} due to no name matches found.")
 
+    end_stage(stage_timer, items=len(fuzzy_ratings))
+    stage_timer = start_stage("unmatched_output")
     matched_professors_count = len(matched_data) # this is an estimate because it doesnt count the elements in the lists, just the keys so profs with the same name are considered 1
     print(f"Matched Professors: {matched_professors_count}")
 
+    unmatched_ratings = remaining_entries(ratings_pool)
+    unmatched_rmp = remaining_entries(rmp_pool)
+
     # append the unmatched ratings data to the final matched data using original names
     for original_ratings_name in ratings_to_append:
-        if original_ratings_name in ratings:
+        if original_ratings_name in unmatched_ratings:
             if original_ratings_name not in matched_data:
-                matched_data[original_ratings_name] = ratings[original_ratings_name]
-            else:
-                matched_data[original_ratings_name].extend(ratings[original_ratings_name])
+                matched_data[original_ratings_name] = []
+            matched_data[original_ratings_name].extend(MatchedProfessor(None, ratings_info) for ratings_info in unmatched_ratings[original_ratings_name])
 
-    print(f"Unmatched Ratings: {len(ratings)}")
-    print(f"Unmatched RMP: {len(rmp_data)}")
+    print(f"Unmatched Ratings: {len(unmatched_ratings)}")
+    print(f"Unmatched RMP: {len(unmatched_rmp)}")
 
     total_professors = len(matched_data)
     print(f"Total professors in data: {total_professors}") # this is an estimate because it doesnt count the elements in the lists, just the keys so profs with the same name are considered 1
 
-    with open("unmatched/unmatched_ratings.json", "w", encoding="utf-8") as f:
-        json.dump(ratings, f, indent=4, ensure_ascii=False)
+    write_snapshot(iter_json_records(unmatched_ratings), "unmatched/unmatched_ratings.json", snapshot_format)
+    write_snapshot(iter_json_records(unmatched_rmp), "unmatched/unmatched_rmp.json", snapshot_format)
+    end_stage(stage_timer, items=len(unmatched_ratings) + len(unmatched_rmp))
 
-    with open("unmatched/unmatched_rmp.json", "w", encoding="utf-8") as f:
-        json.dump(rmp_data, f, indent=4, ensure_ascii=False)
+    return matched_data
+
+
+def entry_fingerprint(name, entry):
+    """Hashes a ratings or RMP entry along with the name it's listed under."""
+    entry = entry.to_json()
+    if isinstance(entry.get("courses"), list): # the RMP course lists come back in any order and are only ever compared as sets
+        entry = {**entry, "courses": sorted(entry["courses"])}
+    return hashlib.sha256(json.dumps([name, entry], sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+def dataset_fingerprints(data, id_key):
+    """Fingerprints every entry of a name keyed dataset, grouped by id."""
+    fingerprints = {}
+    for name, entries in data.items():
+        for entry in entries:
+            fingerprints.setdefault(str(getattr(entry, id_key)), []).append(entry_fingerprint(name, entry))
+    return fingerprints
+
+
+def diff_fingerprints(previous, current):
+    """Lists the ids that were added, changed or removed between two sets of fingerprints."""
+    return {
+        "added": [entry_id for entry_id in current if entry_id not in previous],
+        "changed": [entry_id for entry_id in current if entry_id in previous and current[entry_id] != previous[entry_id]],
+        "removed": [entry_id for entry_id in previous if entry_id not in current],
+    }
+
+
+def match_input_digest(ratings, rmp_data, fuzzy_threshold, scorer):
+    """Hashes everything the match result depends on, including the order of the names, the scorer and the manual matches."""
+    digest = hashlib.sha256(f"{fuzzy_threshold} {scorer}".encode())
+    for data in (ratings, rmp_data):
+        for name, entries in data.items():
+            for entry in entries:
+                digest.update(entry_fingerprint(name, entry).encode())
+            digest.update(b"\n")
+    try:
+        with open("manual_matches.json", "rb") as f:
+            digest.update(f.read())
+    except FileNotFoundError:
+        pass
+    return digest.hexdigest()
 
+
+def load_match_state(state_file=MATCH_STATE_FILE):
+    """Loads the fingerprints and fuzzy matches saved by the last incremental match, returning None if there aren't any."""
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if state.get("version") != MATCH_STATE_VERSION:
+        return None
+    return state
+
+
+def save_match_state(state, state_file=MATCH_STATE_FILE):
+    """Saves the fingerprints and fuzzy matches of a match for the next incremental match."""
+    with open(state_file, "w", encoding="utf-8") as f:
+        json.dump({"version": MATCH_STATE_VERSION, **state}, f, ensure_ascii=False)
+
+
+def match_output_digests(snapshot_format="json"):
+    """Hashes the matched and unmatched files on disk, returning None if any of them is missing."""
+    digests = {}
+    for filename in ("matched/matched_professor_data.json", "unmatched/unmatched_ratings.json", "unmatched/unmatched_rmp.json"):
+        try:
+            with open(snapshot_filename(filename, snapshot_format), "rb") as f:
+                digests[filename] = hashlib.sha256(f.read()).hexdigest()
+        except FileNotFoundError:
+            return None
+    return digests
+
+
+def record_match_outputs(snapshot_format="json", state_file=MATCH_STATE_FILE):
+    """Saves the hashes of the matched and unmatched files an incremental match just wrote in its state."""
+    state = load_match_state(state_file)
+    if state is not None:
+        state["outputs"] = match_output_digests(snapshot_format)
+        save_match_state(state, state_file)
+
+
+def load_previous_match(snapshot_format="json"):
+    """Loads the matched data from the last run as matched professor records, returning None unless its unmatched files are still there too."""
+    try:
+        matched_data = load_snapshot("matched/matched_professor_data.json", snapshot_format)
+        for filename in ("unmatched/unmatched_ratings.json", "unmatched/unmatched_rmp.json"):
+            load_snapshot(filename, snapshot_format)
+    except (FileNotFoundError, ValueError): # json and msgpack decode errors are both ValueErrors
+        return None
+    return {name: [MatchedProfessor.from_json(entry) for entry in entries] for name, entries in matched_data.items()}
+
+
+def refresh_fuzzy_cache(fuzzy_cache, previous_rmp_names, rmp_names, fuzzy_threshold, scorer="fuzzywuzzy"):
+    """Carries the best fuzzy matches of the last run over to a new list of RMP names, only scoring against the RMP names that were added."""
+    previous = set(previous_rmp_names)
+    current = set(rmp_names)
+    # ties go to the RMP name that comes first, so the old results only hold if the names that are still there kept their order
+    if [name for name in previous_rmp_names if name in current] != [name for name in rmp_names if name in previous]:
+        return {}
+
+    added_names = [name for name in rmp_names if name not in previous]
+    added_index = build_candidate_index(dict.fromkeys(added_names)) if added_names else None
+    positions = {name: position for position, name in enumerate(rmp_names)}
+    refreshed = {}
+    for ratings_norm, (best_match, best_score) in fuzzy_cache.items():
+        if best_match is not None and best_match not in current: # the best match is gone, so the name is scored again from scratch
+            continue
+        if added_index:
+            added_match, added_score = find_best_fuzzy_match(ratings_norm, None, fuzzy_threshold, added_index, scorer)
+            if added_match is not None and (best_match is None or added_score > best_score or (added_score == best_score and positions[added_match] < positions[best_match])):
+                best_match, best_score = added_match, added_score
+        refreshed[ratings_norm] = (best_match, best_score)
+    return refreshed
+
+
+def match_incrementally(ratings, rmp_data, fuzzy_threshold=80, workers=1, state_file=MATCH_STATE_FILE, snapshot_format="json", scorer="auto"):
+    """Matches professor data, reusing the last run's result when nothing changed and its fuzzy matches for the names that didn't."""
+    scorer = resolve_scorer(scorer)
+    state = load_match_state(state_file)
+    ratings_fingerprints = dataset_fingerprints(ratings, "instructor_id")
+    rmp_fingerprints = dataset_fingerprints(rmp_data, "rmp_id")
+    input_digest = match_input_digest(ratings, rmp_data, fuzzy_threshold, scorer)
+    _, original_rmp_names = build_name_maps(rmp_data)
+    rmp_names = list(original_rmp_names) # the normalized RMP names in the order the fuzzy phase scans them
+
+    fuzzy_cache = {}
+    if state is None:
+        print("No previous match state found, running a full match.")
+    else:
+        for label, previous, current in (("grade ratings", state["ratings"], ratings_fingerprints), ("RMP", state["rmp"], rmp_fingerprints)):
+            changes = diff_fingerprints(previous, current)
+            print(f"{len(changes['added'])} added, {len(changes['changed'])} changed and {len(changes['removed'])} removed {label} ids since the last match.")
+
+        # a run without --incremental rewrites the matched and unmatched files but not the state, so they're only kept if they're still the ones this state wrote
+        if state["inputs"] == input_digest and state["snapshot_format"] == snapshot_format and state["scorer"] == scorer:
+            if state["outputs"] is not None and state["outputs"] == match_output_digests(snapshot_format):
+                previous_match = load_previous_match(snapshot_format)
+                if previous_match is not None:
+                    print("Nothing changed since the last match, keeping the previous matched data.")
+                    return previous_match
+            else:
+                print("The matched files were replaced since the last incremental match, matching again.")
+
+        if state["fuzzy_threshold"] == fuzzy_threshold and state["scorer"] == scorer:
+            fuzzy_cache = refresh_fuzzy_cache({ratings_norm: tuple(match) for ratings_norm, match in state["fuzzy_matches"].items()}, state["rmp_names"], rmp_names, fuzzy_threshold, scorer)
+
+    matched_data = match_professor_names(ratings, rmp_data, fuzzy_threshold, workers, fuzzy_cache, snapshot_format, scorer)
+
+    ratings_norms = {normalize_name(name) for name in ratings}
+    save_match_state({
+        "inputs": input_digest,
+        "snapshot_format": snapshot_format,
+        "fuzzy_threshold": fuzzy_threshold,
+        "scorer": scorer,
+        "ratings": ratings_fingerprints,
+        "rmp": rmp_fingerprints,
+        "rmp_names": rmp_names,
+        "fuzzy_matches": {ratings_norm: list(match) for ratings_norm, match in fuzzy_cache.items() if ratings_norm in ratings_norms},
+        "outputs": None, # filled in by record_match_outputs once the matched file is written
+    }, state_file)
+    return matched_data
+
+
+def check_incremental_match(matched_data, ratings, rmp_data, fuzzy_threshold=80, workers=1, snapshot_format="json", scorer="auto"):
+    """Runs a full match and reports any differences from the incremental result, returning whether they're identical."""
+    unmatched_filenames = ("unmatched/unmatched_ratings.json", "unmatched/unmatched_rmp.json")
+    incremental_unmatched = [load_snapshot(filename, snapshot_format) for filename in unmatched_filenames]
+
+    print("Running a full match to check the incremental result...")
+    full_matched_data = dict(iter_matched_records(match_professor_names(ratings, rmp_data, fuzzy_threshold, workers, snapshot_format=snapshot_format, scorer=scorer)))
+    matched_data = dict(iter_matched_records(matched_data))
+    differences = [name for name in dict.fromkeys([*full_matched_data, *matched_data]) if full_matched_data.get(name) != matched_data.get(name)]
+    if not differences and list(full_matched_data) != list(matched_data):
+        differences.append("(order of the matched names)")
+    for filename, unmatched in zip(unmatched_filenames, incremental_unmatched):
+        if load_snapshot(filename, snapshot_format) != unmatched:
+            differences.append(f"({snapshot_filename(filename, snapshot_format)})")
+
+    if differences:
+        print(f"Incremental match differs from the full match for {len(differences)} names:")
+        for name in differences:
+            print(f"  - {name}")
+    else:
+        print("Incremental match is identical to the full match.")
+    return not differences
+
+
+def match_data(ratings, rmp_data, args):
+    """Matches the two datasets the way the command line arguments ask for."""
+    if not args.incremental:
+        return match_professor_names(ratings, rmp_data, workers=args.workers, snapshot_format=args.format, scorer=args.scorer)
+    matched_data = match_incrementally(ratings, rmp_data, workers=args.workers, snapshot_format=args.format, scorer=args.scorer)
+    if args.check:
+        check_incremental_match(matched_data, ratings, rmp_data, workers=args.workers, snapshot_format=args.format, scorer=args.scorer)
     return matched_data
 
 
 def main():
     parser = argparse.ArgumentParser(description="Professor Data Matching Script")
-    parser.add_argument("mode", nargs="?", default="normal", choices=["normal", "reload"], help="Execution mode: normal or reload")
+    parser.add_argument("mode", nargs="?", default="normal", choices=["normal", "reload", "cache"], help="Execution mode: normal, reload, or cache to inspect the parse cache")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for parsing the section and grade files and for fuzzy matching")
+    parser.add_argument("--clear", action="store_true", help="With the cache mode, delete every cached partial")
+    parser.add_argument("--incremental", action="store_true", help="Only restamp and log the RMP records whose ratings changed since the last scrape, and only rematch what changed since the last match")
+    parser.add_argument("--check", action="store_true", help="With --incremental, also run a full match and report any differences from the incremental result")
+    parser.add_argument("--format", default="json", choices=SNAPSHOT_FORMATS, help="Format of the ratings, unmatched and matched files: indented json, compact msgpack that loads faster, or ndjson with one name per line")
+    parser.add_argument("--scorer", default="auto", choices=FUZZY_SCORERS, help="Name similarity scorer for fuzzy matching: rapidfuzz when it's installed, otherwise fuzzywuzzy. Both give the same matches")
+    parser.add_argument("--metrics", metavar="FILE", help="Save the wall time, CPU time and peak memory of every stage and the hot path counters to a JSON file")
+    parser.add_argument("--profile", metavar="FILE", help="Run under cProfile and save the stats to a file")
     args = parser.parse_args()
+
+    if args.mode == "cache": # inspect or clear the cached partials of the section and grade files
+        if args.clear:
+            clear_cache()
+            print(f"Parse cache in {CACHE_DIR} cleared.")
+        else:
+            entries = describe_cache()
+            for entry in entries:
+                print(f"{entry['kind']}: {entry['source']} ({entry['size']} bytes, version {entry['version']}) -> {entry['file']}")
+            print(f"{len(entries)} cached partials in {CACHE_DIR}.")
+        return
+
     total_start_time = time.time()
 
+    # the profile only covers this process, the parsing and fuzzy matching workers aren't in it
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(run_pipeline, args)
+        profiler.dump_stats(args.profile)
+        print(f"Profile saved to {args.profile}, view it with python -m pstats {args.profile}")
+    else:
+        run_pipeline(args)
+
+    total_end_time = time.time()
+    print(f"Total execution complete in {total_end_time - total_start_time:.2f} seconds.")
+
+    if args.metrics:
+        save_metrics(args.metrics, {"mode": args.mode, "workers": args.workers, "format": args.format, "scorer": resolve_scorer(args.scorer), "total_seconds": round(total_end_time - total_start_time, 4)})
+        print(f"Metrics saved to {args.metrics}")
+
+
+def scrape_rmp_records(args):
+    """Scrapes the RMP data and converts it to records, returning None if the scrape failed."""
+    from scraper import scrape_rmp_data # selenium takes around half a second to import, so the scraper is only imported when it's used
+    stage_timer = start_stage("scrape")
+    rmp_data = scrape_rmp_data(university_id="1273", incremental=args.incremental, snapshot_format=args.format)
+    end_stage(stage_timer, items=len(rmp_data or {}))
+    return rmp_from_json(rmp_data) if rmp_data is not None else None
+
+
+def run_pipeline(args):
+    """Builds or loads both datasets, matches them and saves the matched data."""
     os.makedirs("ratings", exist_ok=True)
     os.makedirs("unmatched", exist_ok=True)
     os.makedirs("matched", exist_ok=True)
 
 
     if args.mode == "reload": # load existing data if it exists and matches it
+        # reload only reads the files an earlier run wrote in the same format, i.e. a normal run with --format msgpack has to come before reload --format msgpack
+        missing = [snapshot_filename(filename, args.format) for filename in ("ratings/grade_ratings.json", "ratings/rmp_ratings.json") if not os.path.exists(snapshot_filename(filename, args.format))]
+        if missing:
+            print(f"{' and '.join(missing)} not found. Run python main.py --format {args.format} first to build the {args.format} files.")
+            exit(1)
+
         print("Loading professor ratings data...")
-        with open("ratings/grade_ratings.json", "r", encoding="utf-8") as file:
-            ratings = json.load(file)
+        stage_timer = start_stage("load_ratings")
+        ratings = ratings_from_json(load_snapshot("ratings/grade_ratings.json", args.format))
+        end_stage(stage_timer, items=len(ratings))
 
         print("Loading RateMyProfessors data...")
-        with open("ratings/rmp_ratings.json", "r", encoding="utf-8") as file:
-            rmp_data = json.load(file)
-
-        print("Matching professor data from both sources...")
-        matched_data = match_professor_names(ratings, rmp_data)
-
-        with open("matched/matched_professor_data.json", "w", encoding="utf-8") as outfile:
-            json.dump(matched_data, outfile, indent=4, ensure_ascii=False)
-
-        print(f"Matched professor data saved to matched/matched_professor_data.json")
+        stage_timer = start_stage("load_rmp")
+        rmp_data = rmp_from_json(load_snapshot("ratings/rmp_ratings.json", args.format))
+        end_stage(stage_timer, items=len(rmp_data))
 
     else: # scrape RMP data and recalculates professor ratings before running the resulting data
-        print("Calculating professor ratings...")
-        ratings = calculate_professor_ratings()
-
+        # the scrape waits on the browser and the network while the ratings are cpu and disk work on the local files, so the scrape runs in a thread
+        # while the ratings are calculated and matching starts once both are done. an exception in the scrape is raised again by result()
+        from scraper import scrape_stop
+        scrape_stop.clear()
+        executor = ThreadPoolExecutor(max_workers=1)
         print("Scraping professor data from RateMyProfessors...")
-        rmp_data = scrape_rmp_data(university_id="1273")
-
-        print("Matching professor data from both sources...")
-        matched_data = match_professor_names(ratings, rmp_data)
-
-        with open("matched/matched_professor_data.json", "w", encoding="utf-8") as outfile:
-            json.dump(matched_data, outfile, indent=4, ensure_ascii=False)
-
-        print(f"Matched professor data saved to matched/matched_professor_data.json")
-
-    total_end_time = time.time()
-    print(f"Total execution complete in {total_end_time - total_start_time:.2f} seconds.")
+        scrape_future = executor.submit(scrape_rmp_records, args)
+        try:
+            print("Calculating professor ratings...")
+            stage_timer = start_stage("ratings")
+            ratings = calculate_professor_ratings(workers=args.workers, snapshot_format=args.format)
+            end_stage(stage_timer, items=len(ratings or {}))
+
+            rmp_data = scrape_future.result() if ratings is not None else None
+        except BaseException:
+            # a with block would wait for the whole scrape to finish and write the RMP snapshot after the pipeline already failed or was
+            # interrupted, so the scrape is told to stop at the next page and nothing waits on it
+            scrape_stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        if ratings is None: # nothing gets matched without the ratings, so the same goes for a failed ratings calculation
+            scrape_stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            executor.shutdown()
+
+        # both return None after printing what went wrong, matching them anyway would overwrite the last matched data with a partial one
+        if ratings is None:
+            print("The grade ratings failed, stopping the RMP scrape and skipping the matching.")
+            exit(1)
+        if rmp_data is None:
+            print("The RMP scrape failed, skipping the matching.")
+            exit(1)
+
+    print("Matching professor data from both sources...")
+    stage_timer = start_stage("matching")
+    matched_data = match_data(ratings, rmp_data, args)
+    end_stage(stage_timer, items=len(matched_data))
+
+    stage_timer = start_stage("matched_output")
+    write_snapshot(iter_matched_records(matched_data), "matched/matched_professor_data.json", args.format)
+    if args.incremental:
+        record_match_outputs(args.format)
+    end_stage(stage_timer, items=len(matched_data))
+
+    print(f"Matched professor data saved to {snapshot_filename('matched/matched_professor_data.json', args.format)}")
+
+    stage_timer = start_stage("store_export")
+    store_counts = export_store(iter_matched_records(matched_data))
+    end_stage(stage_timer, items=store_counts["professors"])
+    print(f"Professor store saved to {STORE_FILE}")
 
 
 if __name__ == "__main__":
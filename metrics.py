@@ -0,0 +1,99 @@
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource # unix only, the memory readings are left out without it
+except ImportError:
+    resource = None
+
+# one recorder per process, stages and counters are always recorded since they only cost a few clock reads and dict updates per stage
+metrics_state = {
+    "stages": [], # finished stages in the order they ended
+    "counters": {},
+}
+counter_lock = threading.Lock() # the scraper counts pages from several threads
+open_stages = threading.local() # names of the stages running in each thread, innermost last, so a stage in the scrape thread doesn't nest under one in the main thread
+
+
+def thread_open_stages():
+    """Returns the names of the stages running in the current thread."""
+    if not hasattr(open_stages, "names"):
+        open_stages.names = []
+    return open_stages.names
+
+
+def peak_rss_mb():
+    """Returns the highest resident memory of this process so far in MB, or None where it can't be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024 # bytes on macOS, KB everywhere else
+
+
+def reset_metrics():
+    """Forgets every recorded stage and counter."""
+    metrics_state["stages"] = []
+    metrics_state["counters"] = {}
+    thread_open_stages().clear()
+
+
+def start_stage(name):
+    """Starts timing a stage, returning the timer to hand to end_stage."""
+    names = thread_open_stages()
+    names.append(name)
+    return {"name": name, "depth": len(names) - 1, "wall": time.perf_counter(), "cpu": time.thread_time(), "rss": peak_rss_mb()}
+
+
+def end_stage(timer, items=None):
+    """Finishes a stage and records its wall time, the CPU time of the thread that ran it, peak memory and optionally how many items it handled."""
+    record = {
+        "stage": timer["name"],
+        "depth": timer["depth"],
+        "wall_seconds": round(time.perf_counter() - timer["wall"], 4),
+        "cpu_seconds": round(time.thread_time() - timer["cpu"], 4),
+    }
+    rss = peak_rss_mb()
+    if rss is not None:
+        record["peak_rss_mb"] = round(rss, 1) # the peak of the whole process by the end of the stage
+        record["peak_rss_growth_mb"] = round(rss - timer["rss"], 1) # how much this stage raised that peak
+    if items is not None:
+        record["items"] = items
+    metrics_state["stages"].append(record)
+    if timer["name"] in thread_open_stages():
+        thread_open_stages().remove(timer["name"])
+    return record
+
+
+def count(counter, amount=1):
+    """Adds to a hot path counter."""
+    with counter_lock:
+        metrics_state["counters"][counter] = metrics_state["counters"].get(counter, 0) + amount
+
+
+def stage_seconds(name):
+    """Returns the total wall time recorded for a stage."""
+    return sum(record["wall_seconds"] for record in metrics_state["stages"] if record["stage"] == name)
+
+
+def collect_metrics():
+    """Returns the recorded stages and counters along with the normalize_name call counts."""
+    from aggregator import normalize_name # normalize_name is cached, so its cache statistics count every call without touching the hot path
+    cache_info = normalize_name.cache_info()
+    counters = {**metrics_state["counters"], "normalize_name_calls": cache_info.hits + cache_info.misses, "normalize_name_cache_misses": cache_info.misses}
+    return {
+        "stages": metrics_state["stages"],
+        "counters": dict(sorted(counters.items())),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def save_metrics(filename, extra=None):
+    """Writes the collected metrics to a JSON file."""
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({**(extra or {}), **collect_metrics()}, f, indent=4)
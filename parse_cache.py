@@ -0,0 +1,133 @@
+import json
+import hashlib
+import multiprocessing
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+CACHE_DIR = "cache"
+CACHE_VERSION = 2 # bump whenever the parsed partials change shape so old entries are ignored
+
+
+# parsed partials are keyed by the content hash of the source file, the index remembers each file's mtime and size so unchanged files don't need to be rehashed
+def load_cache_index(cache_dir=CACHE_DIR):
+    """Loads the index of source files that have been hashed into the cache."""
+    try:
+        with open(os.path.join(cache_dir, "index.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_cache_index(cache_index, cache_dir=CACHE_DIR):
+    """Saves the index of source files that have been hashed into the cache."""
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(cache_index, f, indent=4, ensure_ascii=False)
+
+
+def file_digest(filepath, cache_index):
+    """Returns the content hash of a file, only rehashing it if its mtime or size changed since it was indexed."""
+    stat = os.stat(filepath)
+    entry = cache_index.get(filepath)
+    if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+        return entry["sha256"]
+
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    cache_index[filepath] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest.hexdigest()}
+    return cache_index[filepath]["sha256"]
+
+
+def partial_path(kind, digest, cache_dir=CACHE_DIR):
+    """Returns the cache file path for a parsed partial."""
+    return os.path.join(cache_dir, f"{kind}-{digest}.json")
+
+
+def load_partial(kind, digest, cache_dir=CACHE_DIR):
+    """Loads a cached partial, returning None if it is missing or from an older cache version."""
+    try:
+        with open(partial_path(kind, digest, cache_dir), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if entry.get("version") != CACHE_VERSION:
+        return None
+    return entry["partial"]
+
+
+def save_partial(kind, digest, source, partial, cache_dir=CACHE_DIR):
+    """Saves a parsed partial along with the file it was parsed from."""
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(partial_path(kind, digest, cache_dir), "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "kind": kind, "source": source, "partial": partial}, f, ensure_ascii=False)
+
+
+def pool_context():
+    """Returns the multiprocessing context for a process pool, a forkserver one while other threads are running and the default otherwise."""
+    # a forked worker gets a copy of the locks the other threads hold, like the scrape thread's in the normal mode, with nothing to release them.
+    # where forkserver isn't available the default is already spawn
+    if threading.active_count() > 1 and "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return None
+
+
+def parse_files(filepaths, parse, workers=1):
+    """Parses each file, mapping over a process pool if more than one worker is requested."""
+    if workers <= 1 or len(filepaths) < 2:
+        return [parse(filepath) for filepath in filepaths]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as executor:
+        return list(executor.map(parse, filepaths))
+
+
+def load_partials(filepaths, kind, parse, cache_dir=CACHE_DIR, workers=1):
+    """Returns the parsed partial for each file in order, only parsing the files whose contents aren't cached yet."""
+    if cache_dir is None:
+        return parse_files(filepaths, parse, workers)
+
+    cache_index = load_cache_index(cache_dir)
+    digests = [file_digest(filepath, cache_index) for filepath in filepaths]
+    partials = [load_partial(kind, digest, cache_dir) for digest in digests]
+
+    # the files are independent until they're merged, so the changed ones can be parsed in parallel while the cache is only touched by this process
+    missing = [i for i, partial in enumerate(partials) if partial is None]
+    for i, partial in zip(missing, parse_files([filepaths[i] for i in missing], parse, workers)):
+        save_partial(kind, digests[i], filepaths[i], partial, cache_dir)
+        partials[i] = partial
+    save_cache_index(cache_index, cache_dir)
+
+    print(f"Parsed {len(missing)} changed {kind} files, loaded {len(filepaths) - len(missing)} from the cache.")
+    return partials
+
+
+def describe_cache(cache_dir=CACHE_DIR):
+    """Lists the cached partials along with the files they were parsed from."""
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for filename in sorted(os.listdir(cache_dir)):
+        if filename == "index.json" or not filename.endswith(".json"):
+            continue
+        filepath = os.path.join(cache_dir, filename)
+        try:
+            with open(filepath, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except json.JSONDecodeError:
+            entry = {}
+        entries.append({
+            "file": filename,
+            "kind": entry.get("kind"),
+            "source": entry.get("source"),
+            "version": entry.get("version"),
+            "size": os.path.getsize(filepath),
+        })
+    return entries
+
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """Deletes every cached partial and the file index."""
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,127 @@
+import sys
+from dataclasses import dataclass
+
+# the entries used to be plain dicts, which store every key again in every entry and keep their own copy of each course code.
+# these slotted records are only used in memory, the ratings, RMP, unmatched and matched files keep the same JSON layout and
+# entries are converted from it when a file is loaded and back to it when one is written
+
+
+def intern_courses(courses):
+    """Interns course codes so every professor that taught a course shares one string for it."""
+    return tuple(sys.intern(course) for course in courses)
+
+
+@dataclass(slots=True)
+class SectionProfile:
+    """An instructor ID listed under a Coursebook instructor name along with the courses it taught."""
+    instructor_id: str
+    courses: set
+
+
+@dataclass(slots=True)
+class GradeRating:
+    """The grade ratings of one instructor ID, overall and per course."""
+    instructor_id: str
+    overall_grade_rating: object # "N/A" when there are no graded students
+    total_grade_count: int
+    course_ratings: dict
+
+    @classmethod
+    def from_json(cls, entry):
+        """Builds a grade rating from its JSON entry."""
+        return cls(entry["instructor_id"], entry["overall_grade_rating"], entry["total_grade_count"], {sys.intern(course): rating for course, rating in entry["course_ratings"].items()})
+
+    def to_json(self):
+        """Returns the JSON entry of the grade rating."""
+        return {
+            "instructor_id": self.instructor_id,
+            "overall_grade_rating": self.overall_grade_rating,
+            "total_grade_count": self.total_grade_count,
+            "course_ratings": self.course_ratings,
+        }
+
+
+@dataclass(slots=True)
+class RmpProfile:
+    """One RateMyProfessors profile, with its courses and tags in the order the scraper stored them."""
+    department: str
+    url: str
+    quality_rating: float
+    difficulty_rating: float
+    would_take_again: int
+    original_rmp_format: str
+    last_updated: str
+    ratings_count: int
+    courses: tuple
+    tags: tuple
+    rmp_id: str
+
+    @classmethod
+    def from_json(cls, entry):
+        """Builds an RMP profile from its JSON entry, which has no courses once it's part of a matched entry."""
+        return cls(
+            sys.intern(entry["department"]) if entry["department"] is not None else None,
+            entry["url"],
+            entry["quality_rating"],
+            entry["difficulty_rating"],
+            entry["would_take_again"],
+            entry["original_rmp_format"],
+            entry["last_updated"],
+            entry["ratings_count"],
+            intern_courses(entry.get("courses", ())),
+            tuple(sys.intern(tag) for tag in entry["tags"]),
+            entry["rmp_id"],
+        )
+
+    def to_json(self, courses=True):
+        """Returns the JSON entry of the profile, leaving out the courses for the matched entries."""
+        entry = {
+            "department": self.department,
+            "url": self.url,
+            "quality_rating": self.quality_rating,
+            "difficulty_rating": self.difficulty_rating,
+            "would_take_again": self.would_take_again,
+            "original_rmp_format": self.original_rmp_format,
+            "last_updated": self.last_updated,
+            "ratings_count": self.ratings_count,
+            "courses": list(self.courses),
+            "tags": list(self.tags),
+            "rmp_id": self.rmp_id,
+        }
+        if not courses:
+            del entry["courses"]
+        return entry
+
+
+@dataclass(slots=True)
+class MatchedProfessor:
+    """A grade rating and the RMP profile it was matched to, or None if it wasn't matched. The merged entry is only built when it's written."""
+    rmp: RmpProfile
+    ratings: GradeRating
+
+    @classmethod
+    def from_json(cls, entry):
+        """Splits a merged entry from the matched file back into its RMP profile and grade rating."""
+        return cls(RmpProfile.from_json(entry) if "rmp_id" in entry else None, GradeRating.from_json(entry))
+
+    def to_json(self):
+        """Returns the merged entry, the RMP fields without the RMP course list followed by the grade rating fields."""
+        if self.rmp is None:
+            return self.ratings.to_json()
+        return {**self.rmp.to_json(courses=False), **self.ratings.to_json()}
+
+
+def ratings_from_json(data):
+    """Converts a name keyed grade ratings dataset to records."""
+    return {name: [GradeRating.from_json(entry) for entry in entries] for name, entries in data.items()}
+
+
+def rmp_from_json(data):
+    """Converts a name keyed RMP dataset to records."""
+    return {name: [RmpProfile.from_json(entry) for entry in entries] for name, entries in data.items()}
+
+
+def iter_json_records(data):
+    """Yields each name of a dataset of records with its entries converted to JSON, one name at a time."""
+    for name, entries in data.items():
+        yield name, [entry.to_json() for entry in entries]
@@ -1,17 +1,23 @@
-from seleniumwire import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import re
+import os
 import time
 import json
+import base64
+import random
+import threading
+import hashlib
 import datetime
 import requests
+from metrics import count, end_stage, start_stage
+from snapshot import load_snapshot, snapshot_filename, write_snapshot
 
 def setup_driver(headless=True):
     """Sets up and returns a Selenium WebDriver."""
+    # selenium is only imported once the browser is needed, which is skipped entirely while the cached headers still work
+    from seleniumwire import webdriver
+    from selenium.webdriver.chrome.options import Options
     driver = None
     try:
         chrome_options = Options()
@@ -30,6 +36,9 @@ def setup_driver(headless=True):
 
 def close_cookie_popup(driver):
     """Closes the cookie popup if it exists."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     try:
         WebDriverWait(driver, 10).until(
             EC.presence_of_element_located((By.CLASS_NAME, "CCPAModal__StyledCloseButton-sc-10x9kq-2"))
@@ -44,6 +53,10 @@ def close_cookie_popup(driver):
 
 def get_headers(driver, school_id):
     """Gets the necessary headers and school ID from the GraphQL request."""
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     try:
         driver.get(f'https://www.ratemyprofessors.com/search/professors/{school_id}?q=*')
     except TimeoutException:
@@ -107,11 +120,21 @@ def normalize_professor_name(name):
     return " ".join(name.lower().split())
 
 
-def query_rmp(headers, school_id):
-    """Queries the RMP GraphQL API to retrieve professor data."""
-    # thank you Michael Zhao for this idea
-    req_data = {
-        "query": """query TeacherSearchPaginationQuery( $count: Int!  $cursor: String $query: TeacherSearchQuery!) { search: newSearch { ...TeacherSearchPagination_search_1jWD3d } }
+GRAPHQL_URL = "https://www.ratemyprofessors.com/graphql"
+PAGE_SIZE = 1000
+SCRAPE_WORKERS = 4 # pages fetched at the same time, kept low so the API isn't hammered
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0 # seconds before the first retry, doubled after every failed attempt with up to the same again added as jitter
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+CHECKPOINT_DIR = "cache/rmp_pages" # pages fetched by an interrupted scrape, kept until a scrape finishes so the next run can resume
+CHECKPOINT_MAX_AGE = 24 * 60 * 60 # seconds a checkpointed page is resumed from, older pages are fetched again so a scrape doesn't mix in ratings from weeks ago
+RMP_RATINGS_FILE = "ratings/rmp_ratings.json"
+CHANGE_LOG_FILE = "ratings/rmp_changes.jsonl" # one line per incremental refresh with the records that changed since the last one
+HEADER_CACHE_FILE = "cache/rmp_headers.json" # headers and school ID captured by the browser, reused until the API stops accepting them
+scrape_stop = threading.Event() # set when the pipeline fails while the scrape runs in its thread, so the scrape gives up at the next page instead of finishing
+
+# thank you Michael Zhao for this idea
+TEACHER_SEARCH_QUERY = """query TeacherSearchPaginationQuery( $count: Int!  $cursor: String $query: TeacherSearchQuery!) { search: newSearch { ...TeacherSearchPagination_search_1jWD3d } }
             fragment TeacherSearchPagination_search_1jWD3d on newSearch {
                 teachers(query: $query, first: $count, after: $cursor) {
                     didFallback
@@ -180,10 +203,16 @@ def query_rmp(headers, school_id):
                     id
                 }
             }
-        """,
+        """
+
+
+def build_search_request(school_id, cursor, count=PAGE_SIZE):
+    """Builds the GraphQL request body for the page of teachers after the cursor."""
+    return {
+        "query": TEACHER_SEARCH_QUERY,
         "variables": {
-            "count": 1000,
-            "cursor": "",
+            "count": count,
+            "cursor": cursor,
             "query": {
                 "text": "",
                 "schoolID": school_id,
@@ -192,95 +221,313 @@ def query_rmp(headers, school_id):
         }
     }
 
-    all_professors = {}
-    more = True
-    while more:
-        more = False
-        res = requests.post('https://www.ratemyprofessors.com/graphql', headers=headers, json=req_data)
 
-        if res.status_code != 200:
-            print(f"HTTP Error: {res.status_code}. Aborting.")
-            return all_professors
+def page_cursor(offset):
+    """Returns the cursor of the result at the offset, in the arrayconnection format the RMP API uses for its cursors."""
+    return base64.b64encode(f"arrayconnection:{offset}".encode()).decode()
+
 
+def create_session(workers=SCRAPE_WORKERS):
+    """Creates a requests session that keeps a connection open for each worker."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_page(session, graphql_url, headers, school_id, cursor):
+    """Fetches the page of teachers after the cursor, retrying failed requests with exponential backoff and jitter."""
+    req_data = build_search_request(school_id, cursor)
+    for attempt in range(MAX_RETRIES + 1):
         try:
-            data = res.json()['data']['search']['teachers']['edges']
-            for d in data:
-                dn = d['node']
-
-                tags = []
-                if dn['teacherRatingTags']:
-                    sorted_tags = sorted(dn['teacherRatingTags'], key=lambda x: x['tagCount'], reverse=True)
-                    tags = [tag['tagName'] for tag in sorted_tags[:5]]
-
-                courses = [normalize_course_name(course['courseName']) for course in dn['courseCodes']]
-                courses = list(set(courses))
-
-                profile_link = f"https://www.ratemyprofessors.com/professor/{dn['legacyId']}" if dn['legacyId'] else None
-
-                professor_data = {
-                    'department': dn['department'],
-                    'url': profile_link,
-                    'quality_rating': dn['avgRating'],
-                    'difficulty_rating': dn['avgDifficulty'],
-                    'would_take_again': round(dn['wouldTakeAgainPercent']),
-                    'original_rmp_format': f"{dn['firstName']} {dn['lastName']}",
-                    'last_updated': datetime.datetime.now().isoformat(),
-                    'ratings_count': dn['numRatings'],
-                    'courses': courses,
-                    'tags': tags,
-                    'rmp_id': str(dn['legacyId'])
-                }
+            res = session.post(graphql_url, headers=headers, json=req_data, timeout=30)
+            error = f"HTTP Error: {res.status_code}"
+            if res.status_code == 200:
+                teachers = res.json()['data']['search']['teachers']
+                count("rmp_pages_fetched")
+                return teachers
+            if res.status_code not in RETRY_STATUSES:
+                break
+        except ValueError: # checked before RequestException since the JSON decode error requests raises is both
+            print(f"Invalid JSON response for the page after cursor '{cursor}'.")
+            return None
+        except (KeyError, TypeError) as e:
+            print(f"Missing Key in JSON: {e}.")
+            return None
+        except requests.RequestException as e:
+            error = f"Request failed: {e}"
+
+        if attempt < MAX_RETRIES:
+            count("rmp_request_retries")
+            delay = RETRY_BACKOFF * 2 ** attempt
+            if scrape_stop.wait(delay + random.uniform(0, delay)):
+                return None
+
+    print(f"{error}. Giving up on the page after cursor '{cursor}'.")
+    return None
+
 
-                professor_name = f"{dn['firstName']} {dn['lastName']}"
-                key = normalize_professor_name(professor_name)
-
-                if key in all_professors:
-                    all_professors[key].append(professor_data)
-                    print(f"Duplicate RMP professor name found: {key}")
-                else:
-                    all_professors[key] = [professor_data]
-
-            if len(data) == 1000:
-                req_data['variables']['cursor'] = data[len(data) - 1]['cursor']
-                more = True
-        except json.JSONDecodeError:
-            print("Invalid JSON response. Aborting.")
-            return all_professors
-        except KeyError as e:
-            print(f"Missing Key in JSON: {e}. Aborting.")
-            return all_professors
+def checkpoint_path(school_id, cursor, checkpoint_dir=CHECKPOINT_DIR):
+    """Returns the checkpoint file path for the page of a school after the cursor."""
+    digest = hashlib.sha256(f"{school_id}:{cursor}".encode()).hexdigest()[:16]
+    return os.path.join(checkpoint_dir, f"page-{digest}.json")
+
+
+def load_checkpoint(school_id, cursor, checkpoint_dir=CHECKPOINT_DIR, max_age=CHECKPOINT_MAX_AGE):
+    """Loads a page fetched by an earlier scrape, returning None if it wasn't checkpointed or the checkpoint is older than max_age seconds."""
+    try:
+        with open(checkpoint_path(school_id, cursor, checkpoint_dir), "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if time.time() - checkpoint["saved_at"] > max_age:
+            return None
+        return checkpoint["teachers"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+        return None
+
+
+def save_checkpoint(school_id, cursor, teachers, checkpoint_dir=CHECKPOINT_DIR):
+    """Saves a fetched page so an interrupted scrape can resume without fetching it again."""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(checkpoint_path(school_id, cursor, checkpoint_dir), "w", encoding="utf-8") as f:
+        json.dump({"school_id": school_id, "cursor": cursor, "saved_at": time.time(), "teachers": teachers}, f, ensure_ascii=False)
+
+
+def get_page(session, graphql_url, headers, school_id, cursor, checkpoint_dir=CHECKPOINT_DIR):
+    """Returns the page of teachers after the cursor, from the checkpoints if an earlier scrape already fetched it. Returns None once the scrape is stopped."""
+    if scrape_stop.is_set():
+        return None
+    teachers = load_checkpoint(school_id, cursor, checkpoint_dir)
+    if teachers is None:
+        teachers = fetch_page(session, graphql_url, headers, school_id, cursor)
+        if teachers is not None:
+            save_checkpoint(school_id, cursor, teachers, checkpoint_dir)
+    else:
+        count("rmp_pages_from_checkpoint")
+    return teachers
+
+
+def build_professor_data(dn):
+    """Converts a teacher node from the GraphQL API into the stored professor format."""
+    tags = []
+    if dn['teacherRatingTags']:
+        sorted_tags = sorted(dn['teacherRatingTags'], key=lambda x: x['tagCount'], reverse=True)
+        tags = [tag['tagName'] for tag in sorted_tags[:5]]
+
+    courses = [normalize_course_name(course['courseName']) for course in dn['courseCodes']]
+    courses = list(set(courses))
+
+    profile_link = f"https://www.ratemyprofessors.com/professor/{dn['legacyId']}" if dn['legacyId'] else None
+
+    return {
+        'department': dn['department'],
+        'url': profile_link,
+        'quality_rating': dn['avgRating'],
+        'difficulty_rating': dn['avgDifficulty'],
+        'would_take_again': round(dn['wouldTakeAgainPercent']),
+        'original_rmp_format': f"{dn['firstName']} {dn['lastName']}",
+        'last_updated': datetime.datetime.now().isoformat(),
+        'ratings_count': dn['numRatings'],
+        'courses': courses,
+        'tags': tags,
+        'rmp_id': str(dn['legacyId'])
+    }
+
+
+def query_rmp(headers, school_id, graphql_url=GRAPHQL_URL, workers=SCRAPE_WORKERS, checkpoint_dir=CHECKPOINT_DIR):
+    """Queries the RMP GraphQL API to retrieve professor data, returning None if any page couldn't be fetched."""
+    session = create_session(workers)
+    cursors = [""]
+    pages = [get_page(session, graphql_url, headers, school_id, "", checkpoint_dir)]
+    complete = pages[0] is not None
+
+    # the cursors are just offsets into the results, so once the first page gives the result count the rest of the pages
+    # can be requested at the same time. if the cursors ever stop looking like offsets, the pages are followed one by one instead
+    if complete and len(pages[0]['edges']) == PAGE_SIZE and pages[0]['edges'][-1]['cursor'] == page_cursor(PAGE_SIZE - 1):
+        result_count = pages[0].get('resultCount') or 0
+        page_cursors = [page_cursor(offset - 1) for offset in range(PAGE_SIZE, result_count, PAGE_SIZE)]
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            fetched = list(executor.map(lambda cursor: get_page(session, graphql_url, headers, school_id, cursor, checkpoint_dir), page_cursors))
+        for cursor, page in zip(page_cursors, fetched):
+            if page is None: # the pages after a failed one stay checkpointed for the next run
+                complete = False
+                break
+            cursors.append(cursor)
+            pages.append(page)
+
+    # a full last page means there are more results than the count said, or the cursors are being followed one by one
+    while complete and len(pages[-1]['edges']) == PAGE_SIZE:
+        cursor = pages[-1]['edges'][-1]['cursor']
+        page = get_page(session, graphql_url, headers, school_id, cursor, checkpoint_dir)
+        if page is None:
+            complete = False
+            break
+        cursors.append(cursor)
+        pages.append(page)
+
+    # a partial result would look like every professor on the missing pages left, so nothing downstream gets it
+    if not complete:
+        print(f"Scrape interrupted after {len(pages)} pages. The fetched pages are checkpointed in {checkpoint_dir}, run again to resume.")
+        return None
+
+    all_professors = {}
+    for page in pages:
+        for d in page['edges']:
+            dn = d['node']
+            professor_data = build_professor_data(dn)
+
+            professor_name = f"{dn['firstName']} {dn['lastName']}"
+            key = normalize_professor_name(professor_name)
+
+            if key in all_professors:
+                all_professors[key].append(professor_data)
+                print(f"Duplicate RMP professor name found: {key}")
+            else:
+                all_professors[key] = [professor_data]
+
+    for cursor in cursors:
+        os.remove(checkpoint_path(school_id, cursor, checkpoint_dir))
 
     return all_professors
 
 
-def scrape_rmp_data(university_id):
-    """Scrapes professor data from RateMyProfessors."""
-    start_time = time.time()  # Start time tracking
+def record_fingerprint(professor_data):
+    """Hashes the parts of a professor record that change when it gets new ratings."""
+    fingerprint = json.dumps([professor_data['ratings_count'], professor_data['quality_rating'], professor_data['tags']], ensure_ascii=False)
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+def refresh_rmp_data(professor_data, previous_data):
+    """Compares freshly scraped records with the stored ones by rmp_id, carrying last_updated forward for the unchanged ones."""
+    previous_records = {entry['rmp_id']: entry for entries in previous_data.values() for entry in entries}
+    changes = {"added": [], "updated": [], "removed": []}
+    scraped_ids = set()
+    for entries in professor_data.values():
+        for entry in entries:
+            scraped_ids.add(entry['rmp_id'])
+            previous = previous_records.get(entry['rmp_id'])
+            if previous is None:
+                changes["added"].append(entry)
+            elif record_fingerprint(previous) != record_fingerprint(entry):
+                changes["updated"].append(entry)
+            else:
+                entry['last_updated'] = previous['last_updated']
+    changes["removed"] = [rmp_id for rmp_id in previous_records if rmp_id not in scraped_ids]
+    return changes
+
+
+def load_rmp_data(filename=RMP_RATINGS_FILE, snapshot_format="json"):
+    """Loads the stored RMP data, returning an empty dict if there isn't any yet."""
+    try:
+        return load_snapshot(filename, snapshot_format)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def append_change_log(changes, change_log_file=CHANGE_LOG_FILE):
+    """Appends the records that changed in a refresh to the change log."""
+    with open(change_log_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"refreshed": datetime.datetime.now().isoformat(), **changes}, ensure_ascii=False) + "\n")
+
+
+def load_cached_headers(university_id, cache_file=HEADER_CACHE_FILE):
+    """Loads the headers and school ID captured for the university by an earlier run, returning None for both if there aren't any."""
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None, None
+    if cached.get("university_id") != university_id or not cached.get("headers") or not cached.get("school_id"):
+        return None, None
+    return cached["headers"], cached["school_id"]
+
+
+def save_cached_headers(university_id, headers, school_id, cache_file=HEADER_CACHE_FILE):
+    """Saves the headers and school ID captured by the browser so later runs can skip it."""
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    with open(cache_file, "w", encoding="utf-8") as f:
+        json.dump({
+            "university_id": university_id,
+            "school_id": school_id,
+            "headers": dict(headers),
+            "saved_at": datetime.datetime.now().isoformat(),
+        }, f, indent=4, ensure_ascii=False)
+
+
+def probe_headers(headers, school_id, graphql_url=GRAPHQL_URL):
+    """Checks that the API still accepts the headers by asking for a single teacher."""
+    try:
+        res = requests.post(graphql_url, headers=headers, json=build_search_request(school_id, "", count=1), timeout=10)
+        return res.status_code == 200 and res.json()['data']['search']['teachers']['edges'] is not None
+    except (requests.RequestException, ValueError, KeyError, TypeError):
+        return False
 
+
+def capture_headers(university_id):
+    """Starts the browser to capture the GraphQL headers and school ID from the search page."""
+    start_time = time.time()
     driver = setup_driver()
     setup_driver_time = time.time()
     print(f"Driver setup time: {setup_driver_time - start_time:.2f} seconds")
 
     headers, school_id = get_headers(driver, university_id)
-    get_headers_time = time.time()
-    print(f"Get headers time: {get_headers_time - setup_driver_time:.2f} seconds")
+    print(f"Get headers time: {time.time() - setup_driver_time:.2f} seconds")
 
     driver.quit()
+    return headers, school_id
+
+
+def scrape_rmp_data(university_id, graphql_url=GRAPHQL_URL, header_cache_file=HEADER_CACHE_FILE, incremental=False, output_filename=RMP_RATINGS_FILE, change_log_file=CHANGE_LOG_FILE, snapshot_format="json"):
+    """Scrapes professor data from RateMyProfessors."""
+    start_time = time.time()  # Start time tracking
+    stage_timer = start_stage("rmp_headers")
+
+    # the browser is only needed to capture the headers, so it's skipped while the ones from the last run still work
+    headers, school_id = load_cached_headers(university_id, header_cache_file)
+    if headers and probe_headers(headers, school_id, graphql_url):
+        print("Reusing the cached GraphQL headers.")
+    else:
+        if headers:
+            print("The cached GraphQL headers no longer work, capturing new ones.")
+        headers, school_id = capture_headers(university_id)
+        if headers and school_id:
+            save_cached_headers(university_id, headers, school_id, header_cache_file)
+    get_headers_time = time.time()
+    end_stage(stage_timer)
 
     if headers and school_id:
-        professor_data = query_rmp(headers, school_id)
+        stage_timer = start_stage("rmp_query")
+        professor_data = query_rmp(headers, school_id, graphql_url)
+        if scrape_stop.is_set(): # the pipeline failed while the last pages came in, the snapshot is left to a run that gets to use it
+            professor_data = None
+        end_stage(stage_timer, items=len(professor_data or {}))
         query_rmp_time = time.time()
         print(f"Query RMP time: {query_rmp_time - get_headers_time:.2f} seconds")
 
-        if professor_data:
-            with open("ratings/rmp_ratings.json", "w", encoding="utf-8") as f:
-                json.dump(professor_data, f, indent=4, ensure_ascii=False)
+        if professor_data and incremental:
+            # only the records whose ratings moved get a new timestamp and go in the change log, the file is left alone if none did.
+            # query_rmp returns None for an interrupted scrape, so the professors on pages that weren't fetched are never logged as removed
+            changes = refresh_rmp_data(professor_data, load_rmp_data(output_filename, snapshot_format))
+            print(f"{len(changes['added'])} new, {len(changes['updated'])} updated and {len(changes['removed'])} removed RMP records since the last scrape.")
+            if any(changes.values()):
+                stage_timer = start_stage("rmp_output")
+                append_change_log(changes, change_log_file)
+                write_snapshot(professor_data, output_filename, snapshot_format)
+                end_stage(stage_timer, items=len(professor_data))
+            print("Data extraction and incremental refresh complete.")
+            end_time = time.time()
+            print(f"Total execution time: {end_time - start_time:.2f} seconds")
+            return professor_data
+        elif professor_data:
+            stage_timer = start_stage("rmp_output")
+            write_snapshot(professor_data, output_filename, snapshot_format)
+            end_stage(stage_timer, items=len(professor_data))
             print("Data extraction and file writing complete.")
             end_time = time.time()
             print(f"Total execution time: {end_time - start_time:.2f} seconds")
             return professor_data
         else:
-            print("Data extraction failed. GraphQL API returned no data.")
+            print(f"Data extraction failed. GraphQL API returned no data or the scrape was interrupted, {snapshot_filename(output_filename, snapshot_format)} was left as is.")
             end_time = time.time()
             print(f"Total execution time: {end_time - start_time:.2f} seconds")
             return None
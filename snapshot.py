@@ -0,0 +1,78 @@
+import json
+import os
+
+SNAPSHOT_FORMATS = ("json", "msgpack", "ndjson")
+SNAPSHOT_VERSION = 1 # bump whenever the layout of the msgpack snapshots changes so old ones are refused instead of misread
+
+
+# the indented json files are the default since they're easy to read and diff, msgpack is a compact binary alternative that's much faster to load back
+# and ndjson puts each name on its own line so the files can be streamed and grepped
+def snapshot_filename(filename, snapshot_format="json"):
+    """Returns the path a snapshot is stored at for the given format, i.e. ratings/grade_ratings.msgpack for msgpack."""
+    if snapshot_format == "json":
+        return filename
+    return f"{os.path.splitext(filename)[0]}.{snapshot_format}"
+
+
+def import_msgpack():
+    """Imports msgpack, which is only needed for the msgpack snapshot format."""
+    try:
+        import msgpack
+    except ImportError:
+        print("The msgpack snapshot format needs the msgpack package, install it with pip install msgpack or use the json format.")
+        exit(1)
+    return msgpack
+
+
+def write_json_items(items, f):
+    """Writes (name, value) pairs as the same indented JSON object json.dump would write for the dict, one pair at a time."""
+    separator = "\n    "
+    f.write("{")
+    for name, value in items:
+        f.write(separator)
+        f.write(json.dumps(name, ensure_ascii=False))
+        f.write(": ")
+        f.write(json.dumps(value, indent=4, ensure_ascii=False).replace("\n", "\n    ")) # json escapes newlines inside strings, so every newline here is indentation
+        separator = ",\n    "
+    f.write("}" if separator == "\n    " else "\n}")
+
+
+# the data can be a name keyed dict or any iterable of (name, value) pairs, which json and ndjson write as they go so the pairs can be built lazily
+def write_snapshot(data, filename, snapshot_format="json"):
+    """Writes data to the snapshot file for the given format."""
+    path = snapshot_filename(filename, snapshot_format)
+    items = data.items() if isinstance(data, dict) else data
+    if snapshot_format == "json":
+        with open(path, "w", encoding="utf-8") as f:
+            write_json_items(items, f)
+        return
+
+    if snapshot_format == "ndjson":
+        with open(path, "w", encoding="utf-8") as f:
+            for name, value in items:
+                f.write(json.dumps([name, value], ensure_ascii=False))
+                f.write("\n")
+        return
+
+    msgpack = import_msgpack()
+    with open(path, "wb") as f:
+        f.write(msgpack.packb({"version": SNAPSHOT_VERSION, "data": dict(items)}, use_bin_type=True)) # msgpack needs the whole map up front
+
+
+def load_snapshot(filename, snapshot_format="json"):
+    """Loads data from the snapshot file for the given format."""
+    path = snapshot_filename(filename, snapshot_format)
+    if snapshot_format == "json":
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    if snapshot_format == "ndjson":
+        with open(path, "r", encoding="utf-8") as f:
+            return dict(json.loads(line) for line in f if line.strip())
+
+    msgpack = import_msgpack()
+    with open(path, "rb") as f:
+        snapshot = msgpack.unpackb(f.read(), raw=False)
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} snapshot, rerun without reload to rebuild it.")
+    return snapshot["data"]
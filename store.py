@@ -0,0 +1,144 @@
+import os
+import sqlite3
+from aggregator import normalize_name
+
+STORE_FILE = "matched/professors.db"
+
+RMP_FIELDS = ("rmp_id", "department", "url", "quality_rating", "difficulty_rating", "would_take_again", "original_rmp_format", "last_updated", "ratings_count")
+
+# the rating columns have no declared type so ints, floats and "N/A" all come back exactly as they went in
+SCHEMA = """
+CREATE TABLE professors (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    normalized_name TEXT NOT NULL,
+    instructor_id TEXT,
+    overall_grade_rating,
+    total_grade_count INTEGER
+);
+CREATE TABLE rmp_profiles (
+    id INTEGER PRIMARY KEY,
+    professor_id INTEGER NOT NULL REFERENCES professors(id),
+    rmp_id TEXT,
+    department TEXT,
+    url TEXT,
+    quality_rating,
+    difficulty_rating,
+    would_take_again,
+    original_rmp_format TEXT,
+    last_updated TEXT,
+    ratings_count INTEGER
+);
+CREATE TABLE course_ratings (
+    professor_id INTEGER NOT NULL REFERENCES professors(id),
+    course_code TEXT NOT NULL,
+    rating
+);
+CREATE TABLE tags (
+    rmp_profile_id INTEGER NOT NULL REFERENCES rmp_profiles(id),
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX professors_normalized_name ON professors(normalized_name);
+CREATE INDEX professors_instructor_id ON professors(instructor_id);
+CREATE INDEX rmp_profiles_professor_id ON rmp_profiles(professor_id);
+CREATE INDEX rmp_profiles_rmp_id ON rmp_profiles(rmp_id);
+CREATE INDEX course_ratings_professor_id ON course_ratings(professor_id);
+CREATE INDEX course_ratings_course_code ON course_ratings(course_code);
+CREATE INDEX tags_rmp_profile_id ON tags(rmp_profile_id);
+"""
+
+
+# the matched data is one big name keyed dict, so the store splits it into tables that can be looked up by name, id or course without loading all of it
+def export_store(matched_records, db_path=STORE_FILE):
+    """Writes the matched professor data, given as (name, entries) pairs, to a SQLite database, replacing the previous one."""
+    professors = []
+    rmp_profiles = []
+    course_ratings = []
+    tags = []
+    for name, entries in matched_records:
+        normalized_name = normalize_name(name)
+        for entry in entries:
+            professor_id = len(professors) + 1
+            professors.append((professor_id, name, normalized_name, entry.get("instructor_id"), entry.get("overall_grade_rating"), entry.get("total_grade_count")))
+            course_ratings.extend((professor_id, course, rating) for course, rating in entry.get("course_ratings", {}).items())
+            if "rmp_id" in entry: # only the matched entries have an RMP profile
+                rmp_profile_id = len(rmp_profiles) + 1
+                rmp_profiles.append((rmp_profile_id, professor_id, *(entry.get(field) for field in RMP_FIELDS)))
+                tags.extend((rmp_profile_id, position, tag) for position, tag in enumerate(entry.get("tags", [])))
+
+    # the database is built next to the old one and swapped in at the end so readers never see a half written store
+    temp_path = f"{db_path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    conn = sqlite3.connect(temp_path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executescript(SCHEMA)
+        with conn: # one transaction for all of the inserts
+            conn.executemany("INSERT INTO professors VALUES (?, ?, ?, ?, ?, ?)", professors)
+            conn.executemany(f"INSERT INTO rmp_profiles VALUES ({', '.join('?' * (len(RMP_FIELDS) + 2))})", rmp_profiles)
+            conn.executemany("INSERT INTO course_ratings VALUES (?, ?, ?)", course_ratings)
+            conn.executemany("INSERT INTO tags VALUES (?, ?, ?)", tags)
+    finally:
+        conn.close()
+    os.replace(temp_path, db_path)
+    return {"professors": len(professors), "rmp_profiles": len(rmp_profiles), "course_ratings": len(course_ratings), "tags": len(tags)}
+
+
+def connect_store(db_path=STORE_FILE):
+    """Opens the professor store for reading."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def load_entries(conn, professor_rows):
+    """Rebuilds the matched data entries of the given professor rows, in the same shape as matched_professor_data.json."""
+    entries = []
+    for professor in professor_rows:
+        entry = {}
+        rmp_profile = conn.execute("SELECT * FROM rmp_profiles WHERE professor_id = ?", (professor["id"],)).fetchone()
+        if rmp_profile is not None:
+            entry.update({field: rmp_profile[field] for field in RMP_FIELDS if field != "rmp_id"})
+            entry["tags"] = [row["tag"] for row in conn.execute("SELECT tag FROM tags WHERE rmp_profile_id = ? ORDER BY position", (rmp_profile["id"],))]
+            entry["rmp_id"] = rmp_profile["rmp_id"]
+        entry["instructor_id"] = professor["instructor_id"]
+        entry["overall_grade_rating"] = professor["overall_grade_rating"]
+        entry["total_grade_count"] = professor["total_grade_count"]
+        entry["course_ratings"] = {row["course_code"]: row["rating"] for row in conn.execute("SELECT course_code, rating FROM course_ratings WHERE professor_id = ? ORDER BY rowid", (professor["id"],))}
+        entries.append(entry)
+    return entries
+
+
+def find_professor(conn, name):
+    """Returns the entries for a professor name, matched the same way names are normalized everywhere else."""
+    rows = conn.execute("SELECT * FROM professors WHERE normalized_name = ? ORDER BY id", (normalize_name(name),)).fetchall()
+    return load_entries(conn, rows)
+
+
+def find_by_instructor_id(conn, instructor_id):
+    """Returns the entries with the given Coursebook instructor ID."""
+    rows = conn.execute("SELECT * FROM professors WHERE instructor_id = ? ORDER BY id", (str(instructor_id),)).fetchall()
+    return load_entries(conn, rows)
+
+
+def find_by_rmp_id(conn, rmp_id):
+    """Returns the entries matched to the given RMP profile ID."""
+    rows = conn.execute("SELECT professors.* FROM professors JOIN rmp_profiles ON rmp_profiles.professor_id = professors.id WHERE rmp_profiles.rmp_id = ? ORDER BY professors.id", (str(rmp_id),)).fetchall()
+    return load_entries(conn, rows)
+
+
+def find_course_professors(conn, course_code):
+    """Returns the name, grade rating for the course and RMP quality rating of every professor that has taught a course."""
+    rows = conn.execute(
+        """SELECT professors.name, course_ratings.rating, rmp_profiles.quality_rating
+        FROM course_ratings
+        JOIN professors ON professors.id = course_ratings.professor_id
+        LEFT JOIN rmp_profiles ON rmp_profiles.professor_id = professors.id
+        WHERE course_ratings.course_code = ?
+        ORDER BY professors.id""",
+        (course_code.upper().replace(" ", ""),),
+    ).fetchall()
+    return [{"name": row["name"], "course_rating": row["rating"], "quality_rating": row["quality_rating"]} for row in rows]